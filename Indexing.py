@@ -1,8 +1,15 @@
 from sentence_transformers import SentenceTransformer
+import numpy as np
+import torch
 import chromadb
+from chromadb.config import Settings
 from chromadb.utils import embedding_functions
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, READ_ACCESS
+import hashlib
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm   # progress bar
  
 # -----------------------------
@@ -10,12 +17,34 @@ from tqdm import tqdm   # progress bar
 # -----------------------------
 MODEL_NAME = "sentence-transformers/all-MiniLM-L12-v2"
  
-# If you want a shared model object for other code, you can still keep this:
-embedding_model = SentenceTransformer(MODEL_NAME)
+# Set EMBED_QUANTIZE=0 to keep the full FP32 model.
+EMBED_QUANTIZE = os.getenv("EMBED_QUANTIZE", "1") == "1"
  
-# Chroma embedding function wrapper
+ 
+def _reduce_precision(model: SentenceTransformer) -> SentenceTransformer:
+    """
+    FP16 on GPU, dynamic int8 Linear layers on CPU.
+    Negligible recall loss for MiniLM, ~2x encode throughput.
+    """
+    if torch.cuda.is_available():
+        return model.half()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+ 
+ 
+# GPU when there is one; both model copies below follow this
+EMBED_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+ 
+# Shared model object: used for bulk indexing and for query embeddings (Search.py)
+embedding_model = SentenceTransformer(MODEL_NAME, device=EMBED_DEVICE)
+if EMBED_QUANTIZE:
+    embedding_model = _reduce_precision(embedding_model)
+ 
+# Chroma embedding function wrapper. Everything on our query/index path hands
+# Chroma precomputed vectors; this only runs if someone passes raw
+# query_texts/documents, and then it shouldn't silently fall back to CPU.
 chroma_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name=MODEL_NAME
+    model_name=MODEL_NAME,
+    device=EMBED_DEVICE,
 )
  
  
@@ -26,7 +55,11 @@ CHROMA_DB_PATH = "./chroma_db_vecc"
 os.makedirs(CHROMA_DB_PATH, exist_ok=True)
  
 # IMPORTANT: use chromadb.PersistentClient (not chroma.PersistentClient)
-chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+# Telemetry off: no posthog HTTP calls on the query path.
+chroma_client = chromadb.PersistentClient(
+    path=CHROMA_DB_PATH,
+    settings=Settings(anonymized_telemetry=False),
+)
  
 # Sections (vector search over section text)
 sections_collection = chroma_client.get_or_create_collection(
@@ -55,13 +88,67 @@ entities_collection = chroma_client.get_or_create_collection(
 # -----------------------------
 driver = GraphDatabase.driver(
     uri="bolt://localhost:7687",
-    auth=("neo4j", "ds246@IISc")
+    auth=("neo4j", "ds246@IISc"),
+    max_connection_pool_size=64,          # room for concurrent tool calls
+    connection_acquisition_timeout=30,
+    connection_timeout=5,                 # fail fast if Neo4j is down
 )
  
  
 # -----------------------------
 # 4. Indexing functions
 # -----------------------------
+ENCODE_BATCH_SIZE = 256
+ 
+ 
+def embed_query(text: str) -> list[float]:
+    """Query-time embedding with the shared (reduced-precision) model."""
+    return embedding_model.encode(text, convert_to_numpy=True, normalize_embeddings=True).tolist()
+ 
+ 
+def encode_documents(texts, show_progress_bar: bool = True, seen: dict | None = None):
+    """
+    Embed all documents up front in large batches (GPU if available) and hand
+    the vectors straight to Chroma, instead of letting Chroma's embedding
+    function run one small forward pass per upsert batch.
+ 
+    The matrix is kept as float16 until each batch is upserted: half the RAM
+    for the whole corpus' vectors while indexing. Chroma's HNSW itself still
+    stores float32, so search quality is unchanged apart from fp16 rounding.
+ 
+    Identical documents (boilerplate / near-empty sections) are only encoded
+    once and fanned back out to every position that uses them. Pass the same
+    `seen` dict to every call of a streaming run to dedupe across calls: it maps
+    a 16-byte text digest to that text's float16 vector, so it costs about one
+    vector per unique document, not the texts themselves.
+    """
+    if seen is None:
+        seen = {}
+ 
+    keys = []
+    new_texts = []
+    new_keys = {}        # digest -> index into new_texts (dupes within this call)
+    for t in texts:
+        key = hashlib.blake2b(t.encode("utf-8"), digest_size=16).digest()
+        keys.append(key)
+        if key not in seen and key not in new_keys:
+            new_keys[key] = len(new_texts)
+            new_texts.append(t)
+ 
+    if new_texts:
+        embeddings = embedding_model.encode(
+            new_texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=show_progress_bar,
+        ).astype(np.float16)
+        for key, row in new_keys.items():
+            seen[key] = embeddings[row]
+ 
+    return np.stack([seen[k] for k in keys]) if keys else np.empty((0, 0), np.float16)
+ 
+ 
 def index_sections_into_chroma(batch_size: int = 30):
     """
     Pulls sections from Neo4j and stores their embeddings + metadata
@@ -70,69 +157,119 @@ def index_sections_into_chroma(batch_size: int = 30):
     IMPORTANT: We intentionally DO NOT embed section numbers / IDs
     in the document text to avoid similarity artifacts (e.g., 112 vs 113).
     Those stay only in metadata.
+ 
+    Streams: this thread reads the Neo4j cursor and queues chunks of
+    ENCODE_BATCH_SIZE sections; a worker thread encodes + upserts them.
+    Memory stays bounded by the queue size and fetch overlaps encoding.
     """
  
     with driver.session() as session:
-        records = session.run(
-            """
-            MATCH (a:Act)-[:HAS_SECTION]->(s:Section)
-            RETURN id(s) AS sid, a, s
-            """
-        ).data()
- 
-    print(f"Found {len(records)} sections to index into Chroma")
- 
+        total = session.run(
+            "MATCH (:Act)-[:HAS_SECTION]->(:Section) RETURN count(*) AS c"
+        ).single()["c"]
+ 
+    print(f"Found {total} sections to index into Chroma")
+ 
+    work: queue.Queue = queue.Queue(maxsize=4)   # None = end of stream
+    errors = []
+    seen = {}    # text digest -> vector, shared by every chunk (see encode_documents)
+    pbar = tqdm(total=total, desc="🔧 Indexing Sections into Chroma")
+ 
+    def upsert_worker():
+        try:
+            while True:
+                chunk = work.get()
+                if chunk is None:
+                    return
+                chunk_ids, chunk_texts, chunk_meta = chunk
+                embeddings = encode_documents(chunk_texts, show_progress_bar=False, seen=seen)
+ 
+                # Vectors + metadata only: nothing reads the documents back,
+                # so we don't store (or later ship) the full section bodies.
+                for i in range(0, len(chunk_ids), batch_size):
+                    sections_collection.upsert(
+                        ids=chunk_ids[i:i+batch_size],
+                        embeddings=embeddings[i:i+batch_size].tolist(),
+                        metadatas=chunk_meta[i:i+batch_size],
+                    )
+                pbar.update(len(chunk_ids))
+        except BaseException as e:
+            errors.append(e)
+            # keep draining so the producer never blocks on a full queue
+            while work.get() is not None:
+                pass
+ 
+    worker = threading.Thread(target=upsert_worker, daemon=True)
+    worker.start()
+ 
+    count = 0
     ids, texts, metadatas = [], [], []
  
-    for rec in records:
-        act = rec["a"]
-        sec = rec["s"]
-        sid = rec["sid"]
- 
-        # Section identifier stored only as metadata, not in embedded text
-        article_id = sec.get("section_id") or sec.get("article_id")
- 
-        act_title = act.get("title") or act.get("name") or ""
-        heading = sec.get("heading") or ""
-        summary = sec.get("summary") or ""
-        text = sec.get("text") or ""
- 
-        # 👇 This is what gets embedded: NO sectionNo, NO citation, NO ID.
-        body = (
-            f"{act_title}\n"
-            f"{heading}\n\n"
-            f"{summary}\n\n"
-            f"{text}"
-        ).strip()
- 
-        ids.append(str(sid))
-        texts.append(body)
-        metadatas.append(
-            {
-                "neo4j_id": sid,
-                "act_title": act.get("title") or act.get("name"),
-                "act_year": act.get("year"),
-                "act_number": act.get("act_number"),
-                "section_id": article_id,
-                "sectionNo": sec.get("sectionNo"),   # kept only as metadata
-                "citation": sec.get("citation"),
-                "node_label": "Section",
-            }
-        )
- 
-    # Batch upload with progress bar
-    for i in tqdm(range(0, len(ids), batch_size), desc="🔧 Indexing Sections into Chroma"):
-        batch_ids = ids[i:i+batch_size]
-        batch_texts = texts[i:i+batch_size]
-        batch_meta = metadatas[i:i+batch_size]
- 
-        sections_collection.upsert(
-            ids=batch_ids,
-            documents=batch_texts,
-            metadatas=batch_meta,
-        )
- 
-    print(f"✔ Completed indexing: {len(ids)} sections stored in ChromaDB at `{CHROMA_DB_PATH}`")
+    try:
+        # Records keep the raw Node objects (read via Node.get below) instead of
+        # converting every node to a dict with .data()
+        with driver.session() as session:
+            for rec in session.run(
+                """
+                MATCH (a:Act)-[:HAS_SECTION]->(s:Section)
+                RETURN id(s) AS sid, a, s
+                """
+            ):
+                act = rec["a"]
+                sec = rec["s"]
+                sid = rec["sid"]
+ 
+                # Section identifier stored only as metadata, not in embedded text
+                article_id = sec.get("section_id") or sec.get("article_id")
+ 
+                act_title = act.get("title") or act.get("name") or ""
+                heading = sec.get("heading") or ""
+                summary = sec.get("summary") or ""
+                text = sec.get("text") or ""
+ 
+                # 👇 This is what gets embedded: NO sectionNo, NO citation, NO ID.
+                body = (
+                    f"{act_title}\n"
+                    f"{heading}\n\n"
+                    f"{summary}\n\n"
+                    f"{text}"
+                ).strip()
+ 
+                ids.append(str(sid))
+                texts.append(body)
+                metadatas.append(
+                    {
+                        "neo4j_id": sid,
+                        "act_title": act.get("title") or act.get("name"),
+                        "act_year": act.get("year"),
+                        "act_number": act.get("act_number"),
+                        "section_id": article_id,
+                        "sectionNo": sec.get("sectionNo"),   # kept only as metadata
+                        "citation": sec.get("citation"),
+                        "node_label": "Section",
+                    }
+                )
+ 
+                if len(ids) >= ENCODE_BATCH_SIZE:
+                    if errors:
+                        break   # worker died; stop reading, re-raise below
+                    work.put((ids, texts, metadatas))
+                    count += len(ids)
+                    ids, texts, metadatas = [], [], []
+ 
+        if ids:
+            work.put((ids, texts, metadatas))
+            count += len(ids)
+    finally:
+        work.put(None)
+        worker.join()
+        pbar.close()
+ 
+    if errors:
+        raise errors[0]
+ 
+    print(f"✔ Completed indexing: {count} sections stored in ChromaDB at `{CHROMA_DB_PATH}` "
+          f"({len(seen)} unique texts embedded)")
     print(f"Sections in Chroma collection now: {sections_collection.count()}")
  
  
@@ -142,9 +279,9 @@ def index_acts_into_chroma():
     """
  
     with driver.session() as session:
-        acts = session.run(
+        acts = list(session.run(
             "MATCH (a:Act) RETURN id(a) AS aid, a.title AS title, a.year AS year, a.act_number AS act_number"
-        ).data()
+        ))
  
     print(f"Found {len(acts)} acts to index into Chroma")
  
@@ -165,14 +302,20 @@ def index_acts_into_chroma():
  
     acts_collection.upsert(
         ids=ids,
-        documents=docs,
-        metadatas=meta,
+        embeddings=encode_documents(docs).tolist(),
+        metadatas=meta,   # title is already in metadata
     )
  
     print(f"✔ Completed indexing: {len(ids)} acts stored in ChromaDB at `{CHROMA_DB_PATH}`")
     print(f"Acts in Chroma collection now: {acts_collection.count()}")
  
  
+def _run_read_query(cypher: str):
+    """Run one read query in its own session (safe to call from worker threads)."""
+    with driver.session(default_access_mode=READ_ACCESS) as session:
+        return list(session.run(cypher))
+ 
+ 
 def index_entities_into_chroma(batch_size: int = 50):
     """
     Index other entities: DefinedTerm, Role, Obligation, Penalty
@@ -182,81 +325,84 @@ def index_entities_into_chroma(batch_size: int = 50):
     but keep all IDs / numeric fields only in metadata.
     """
  
-    with driver.session() as session:
+    entity_queries = {
         # DefinedTerm with context of the defining section
-        term_recs = session.run(
-            """
-            MATCH (a:Act)-[:HAS_SECTION]->(s:Section)-[:DEFINES]->(t:DefinedTerm)
-            RETURN
-              id(t) AS nid,
-              t.id AS entity_id,
-              t.name AS name,
-              a.title AS act_title,
-              a.year AS act_year,
-              s.sectionNo AS section_no,
-              s.heading AS heading,
-              s.summary AS summary,
-              s.text AS section_text
-            """
-        ).data()
+        "terms": """
+        MATCH (a:Act)-[:HAS_SECTION]->(s:Section)-[:DEFINES]->(t:DefinedTerm)
+        RETURN
+          id(t) AS nid,
+          t.id AS entity_id,
+          t.name AS name,
+          a.title AS act_title,
+          a.year AS act_year,
+          s.sectionNo AS section_no,
+          s.heading AS heading,
+          s.summary AS summary,
+          s.text AS section_text
+        """,
  
         # Roles, with Acts they appear in
-        role_recs = session.run(
-            """
-            MATCH (r:Role)
-            OPTIONAL MATCH (r)-[:APPEARS_IN_ACT]->(a:Act)
-            OPTIONAL MATCH (s:Section)-[:MENTIONS_ROLE]->(r)
-            RETURN
-              id(r) AS nid,
-              r.id AS entity_id,
-              r.name AS name,
-              collect(DISTINCT a.title) AS act_titles,
-              collect(DISTINCT s.heading) AS headings
-            """
-        ).data()
+        "roles": """
+        MATCH (r:Role)
+        OPTIONAL MATCH (r)-[:APPEARS_IN_ACT]->(a:Act)
+        OPTIONAL MATCH (s:Section)-[:MENTIONS_ROLE]->(r)
+        RETURN
+          id(r) AS nid,
+          r.id AS entity_id,
+          r.name AS name,
+          collect(DISTINCT a.title) AS act_titles,
+          collect(DISTINCT s.heading) AS headings
+        """,
  
         # Obligations, linked to Section + Role
-        obl_recs = session.run(
-            """
-            MATCH (a:Act)-[:HAS_SECTION]->(s:Section)-[:IMPOSES_OBLIGATION]->(o:Obligation)
-            OPTIONAL MATCH (o)-[:OBLIGATION_ON]->(r:Role)
-            RETURN
-              id(o) AS nid,
-              o.id AS entity_id,
-              o.action AS action,
-              o.conditions AS conditions,
-              o.source_span AS source_span,
-              a.title AS act_title,
-              a.year AS act_year,
-              s.sectionNo AS section_no,
-              s.heading AS heading,
-              s.summary AS summary,
-              s.text AS section_text,
-              collect(DISTINCT r.name) AS roles
-            """
-        ).data()
+        "obligations": """
+        MATCH (a:Act)-[:HAS_SECTION]->(s:Section)-[:IMPOSES_OBLIGATION]->(o:Obligation)
+        OPTIONAL MATCH (o)-[:OBLIGATION_ON]->(r:Role)
+        RETURN
+          id(o) AS nid,
+          o.id AS entity_id,
+          o.action AS action,
+          o.conditions AS conditions,
+          o.source_span AS source_span,
+          a.title AS act_title,
+          a.year AS act_year,
+          s.sectionNo AS section_no,
+          s.heading AS heading,
+          s.summary AS summary,
+          s.text AS section_text,
+          collect(DISTINCT r.name) AS roles
+        """,
  
         # Penalties, linked to Section + Role
-        pen_recs = session.run(
-            """
-            MATCH (a:Act)-[:HAS_SECTION]->(s:Section)-[:PRESCRIBES_PENALTY]->(p:Penalty)
-            OPTIONAL MATCH (p)-[:APPLIES_TO]->(r:Role)
-            RETURN
-              id(p) AS nid,
-              p.id AS entity_id,
-              p.description AS description,
-              p.imprisonment AS imprisonment,
-              p.fine_amount AS fine_amount,
-              p.source_span AS source_span,
-              a.title AS act_title,
-              a.year AS act_year,
-              s.sectionNo AS section_no,
-              s.heading AS heading,
-              s.summary AS summary,
-              s.text AS section_text,
-              collect(DISTINCT r.name) AS roles
-            """
-        ).data()
+        "penalties": """
+        MATCH (a:Act)-[:HAS_SECTION]->(s:Section)-[:PRESCRIBES_PENALTY]->(p:Penalty)
+        OPTIONAL MATCH (p)-[:APPLIES_TO]->(r:Role)
+        RETURN
+          id(p) AS nid,
+          p.id AS entity_id,
+          p.description AS description,
+          p.imprisonment AS imprisonment,
+          p.fine_amount AS fine_amount,
+          p.source_span AS source_span,
+          a.title AS act_title,
+          a.year AS act_year,
+          s.sectionNo AS section_no,
+          s.heading AS heading,
+          s.summary AS summary,
+          s.text AS section_text,
+          collect(DISTINCT r.name) AS roles
+        """,
+    }
+ 
+    # Independent reads -> run them side by side, one short-lived session each
+    with ThreadPoolExecutor(max_workers=len(entity_queries)) as pool:
+        futures = {k: pool.submit(_run_read_query, q) for k, q in entity_queries.items()}
+        entity_recs = {k: f.result() for k, f in futures.items()}
+ 
+    term_recs = entity_recs["terms"]
+    role_recs = entity_recs["roles"]
+    obl_recs = entity_recs["obligations"]
+    pen_recs = entity_recs["penalties"]
  
     print("Found entities to index:")
     print(f"  DefinedTerm: {len(term_recs)}")
@@ -392,15 +538,17 @@ def index_entities_into_chroma(batch_size: int = 50):
             }
         )
  
+    embeddings = encode_documents(docs)
+ 
     # -------- Batch upsert --------
     for i in tqdm(range(0, len(ids), batch_size), desc="🔧 Indexing Entities into Chroma"):
         batch_ids = ids[i:i+batch_size]
-        batch_docs = docs[i:i+batch_size]
         batch_meta = metas[i:i+batch_size]
  
+        # vectors + metadata only (documents are never read back)
         entities_collection.upsert(
             ids=batch_ids,
-            documents=batch_docs,
+            embeddings=embeddings[i:i+batch_size].tolist(),
             metadatas=batch_meta,
         )
  
@@ -408,6 +556,59 @@ def index_entities_into_chroma(batch_size: int = 50):
     print(f"Entities in Chroma collection now: {entities_collection.count()}")
  
  
+def ensure_search_indexes():
+    """
+    Create the Neo4j indexes the query-time fallbacks in Graph_RAG_new.py rely on:
+      - Section.section_id_upper (uppercase copy of sectionNo) for explicit
+        "Section 420" lookups, instead of toUpper() over every Section
+      - full-text index on Act.title for act-title queries, instead of a
+        CONTAINS scan over every Act
+      - Act.title_lower (lowercased title) + text index for substring matches,
+        instead of toLower() on every Act per query
+      - full-text (BM25) index on Section.text / Section.summary for the
+        lexical retriever in Search.fulltext_search_sections
+    Idempotent – safe to run on every indexing run, and Graph_RAG_new runs it
+    at import so serving never hits a graph without this schema. The backfills
+    only touch nodes whose copy is missing or stale, so a repeat run writes
+    nothing.
+    """
+    with driver.session() as session:
+        session.run(
+            """
+            MATCH (s:Section)
+            WHERE s.sectionNo IS NOT NULL
+              AND s.section_id_upper IS NULL
+            SET s.section_id_upper = toUpper(toString(s.sectionNo))
+            """
+        )
+        session.run(
+            """
+            MATCH (a:Act)
+            WHERE a.title IS NOT NULL
+              AND (a.title_lower IS NULL OR a.title_lower <> toLower(a.title))
+            SET a.title_lower = toLower(a.title)
+            """
+        )
+        session.run(
+            "CREATE INDEX section_id_idx IF NOT EXISTS FOR (s:Section) ON (s.section_id_upper)"
+        )
+        session.run(
+            "CREATE FULLTEXT INDEX act_title_ft IF NOT EXISTS FOR (a:Act) ON EACH [a.title]"
+        )
+        session.run(
+            "CREATE FULLTEXT INDEX section_fts IF NOT EXISTS FOR (s:Section) ON EACH [s.text, s.summary]"
+        )
+        session.run(
+            "CREATE TEXT INDEX act_title_lower_idx IF NOT EXISTS FOR (a:Act) ON (a.title_lower)"
+        )
+        # new indexes populate in the background; querying one before it is
+        # ONLINE fails, so wait here rather than on the first user query
+        session.run("CALL db.awaitIndexes(300)")
+ 
+    print("✔ Neo4j search indexes in place "
+          "(section_id_idx, act_title_ft, act_title_lower_idx, section_fts)")
+ 
+ 
 # -----------------------------
 # 5. Debug helpers
 # -----------------------------
@@ -445,6 +646,7 @@ def debug_chroma_counts():
  
  
 if __name__ == "__main__":
+    ensure_search_indexes()
     debug_neo4j_counts()
     index_acts_into_chroma()
     index_sections_into_chroma()
@@ -1,13 +1,19 @@
 # rag_search.py
+import functools
 import re
-from collections import defaultdict
-from typing import List, Dict, Any
+from heapq import nlargest
+from typing import List, Dict, Any, Iterable
  
-from Indexing import driver, sections_collection, acts_collection  # reuse driver & collection
+from neo4j import Result, RoutingControl
+ 
+from Indexing import driver, sections_collection, acts_collection, embed_query  # reuse driver & collection
  
 # Only capture Section/Article numbers
 ARTICLE_REGEX = re.compile(r"(?i)\b(article|section)\s+(\d+[A-Z-]*)")
  
+# Characters with special meaning in Lucene query syntax (db.index.fulltext.*)
+LUCENE_SPECIAL_REGEX = re.compile(r'([+\-!(){}\[\]^"~*?:\\/&|])')
+ 
  
  
 def extract_article_id(query: str) -> str | None:
@@ -20,36 +26,68 @@ def extract_article_id(query: str) -> str | None:
     return m.group(2).upper()
  
  
+@functools.lru_cache(maxsize=1024)
+def cached_query_embedding(query: str) -> tuple[float, ...]:
+    """
+    Embed a query once per process. One agent turn embeds the same string for
+    the vector search and again for the semantic fallback, and agent sessions
+    repeat queries. Tuple so the cached value can't be mutated by a caller.
+    """
+    return tuple(embed_query(query))
+ 
+ 
+def lucene_escape(text: str) -> str:
+    """Escape user text so it can be passed to db.index.fulltext.queryNodes."""
+    return LUCENE_SPECIAL_REGEX.sub(r"\\\1", text)
+ 
+ 
+def lucene_phrase(text: str) -> str:
+    """Quoted Lucene phrase query, the closest match to a CONTAINS filter."""
+    return '"' + lucene_escape(text.strip()) + '"'
+ 
+ 
 # Search.py
  
-def fulltext_search_sections(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+_SECTION_FTS_Q = """
+CALL db.index.fulltext.queryNodes("section_fts", $q) YIELD node AS s, score
+MATCH (a:Act)-[:HAS_SECTION]->(s)
+RETURN id(s) AS sid,
+       id(a) AS aid,
+       score
+LIMIT $limit
+"""
+ 
+ 
+def fulltext_search_sections(query: str, limit: int = 10, session=None) -> List[Dict[str, Any]]:
     """
-    Lexical search over Section.text / Section.summary without using a fulltext index.
-    Does NOT modify the KG or require db.index.fulltext.*.
+    Lexical (BM25) search over Section.text / Section.summary via the
+    `section_fts` full-text index (created by Indexing.ensure_search_indexes).
+    Returns {sid, aid, score} rows with the native Lucene score, best first;
+    section/act properties are fetched later for the fused ids only.
+    Reuses `session` if given, otherwise goes through driver.execute_query
+    (pooled, auto-retried read).
     """
-    q = query.lower()
- 
-    with driver.session() as session:
-        recs = session.run(
-            """
-            MATCH (a:Act)-[:HAS_SECTION]->(s:Section)
-            WHERE
-              (s.text IS NOT NULL AND toLower(s.text) CONTAINS $q) OR
-              (s.summary IS NOT NULL AND toLower(s.summary) CONTAINS $q)
-            RETURN id(s) AS sid,
-                   1.0 AS score,   // dummy score to keep same shape
-                   a,
-                   s
-            LIMIT $limit
-            """,
-            {"q": q, "limit": limit},
-        ).data()
-    return recs
+    if not query.strip():
+        return []
+ 
+    # lowercase so AND / OR / NOT in user text are plain terms, not operators
+    params = {"q": lucene_escape(query.lower()), "limit": limit}
+ 
+    if session is None:
+        return driver.execute_query(
+            _SECTION_FTS_Q,
+            params,
+            routing_=RoutingControl.READ,
+            result_transformer_=Result.data,
+        )
+ 
+    return session.run(_SECTION_FTS_Q, params).data()
  
 def vector_search_acts(query: str, limit: int = 10):
     res = acts_collection.query(
-        query_texts=[query],
+        query_embeddings=[list(cached_query_embedding(query))],
         n_results=limit,
+        include=["metadatas", "distances"],
     )
     results = []
     for i, aid in enumerate(res["ids"][0]):
@@ -63,24 +101,16 @@ def vector_search_acts(query: str, limit: int = 10):
         )
     return results
  
-def vector_search_sections(query: str, article_id: str | None = None, limit: int = 10):
-    """
-    Semantic search over section text+summary in Chroma.
-    If article_id is provided, we filter on that section_id to avoid 24-A vs 24-B confusion.
-    """
-    where = {}
-    if article_id:
-        where["section_id"] = article_id
+# how many extra neighbours to pull when post-filtering on article_id
+ARTICLE_OVERFETCH = 8
  
-    res = sections_collection.query(
-        query_texts=[query],
-        n_results=limit,
-        where=where or None,
-    )
  
+def _section_hits(res, article_id: str | None, limit: int):
     results = []
     for i, sid in enumerate(res["ids"][0]):
         md = res["metadatas"][0][i]
+        if article_id and md.get("section_id") != article_id:
+            continue
         results.append(
             {
                 "sid": int(md["neo4j_id"]),
@@ -88,14 +118,52 @@ def vector_search_sections(query: str, article_id: str | None = None, limit: int
                 "metadata": md,
             }
         )
+        if len(results) >= limit:
+            break
+    return results
+ 
+ 
+def vector_search_sections(query: str, article_id: str | None = None, limit: int = 10):
+    """
+    Semantic search over section text+summary in Chroma.
+    If article_id is provided, we filter on that section_id to avoid 24-A vs 24-B confusion.
+    The filter is applied in Python over an over-fetched HNSW result: Chroma's
+    `where` goes through its SQLite metadata path, which gets slow as the
+    collection grows. Only if none of the neighbours match do we pay for it.
+    """
+    emb = [list(cached_query_embedding(query))]
+    n = limit * ARTICLE_OVERFETCH if article_id else limit
+ 
+    res = sections_collection.query(
+        query_embeddings=emb,
+        n_results=n,
+        include=["metadatas", "distances"],
+    )
+    results = _section_hits(res, article_id, limit)
+ 
+    if article_id and not results:
+        res = sections_collection.query(
+            query_embeddings=emb,
+            n_results=limit,
+            where={"section_id": article_id},
+            include=["metadatas", "distances"],
+        )
+        results = _section_hits(res, None, limit)
+ 
     return results
  
 def smart_semantic_search(query: str, limit: int = 10):
+    query_emb = list(cached_query_embedding(query))
+ 
     # Section vector search
-    sec_res = sections_collection.query(query_texts=[query], n_results=limit)
+    sec_res = sections_collection.query(
+        query_embeddings=[query_emb], n_results=limit, include=["metadatas", "distances"]
+    )
  
     # Act title vector search
-    act_res = acts_collection.query(query_texts=[query], n_results=limit)
+    act_res = acts_collection.query(
+        query_embeddings=[query_emb], n_results=limit, include=["metadatas", "distances"]
+    )
  
     merged = []
  
@@ -116,26 +184,55 @@ def smart_semantic_search(query: str, limit: int = 10):
  
  
  
+def dedupe_first(ids: Iterable[int], n: int) -> List[int]:
+    """Order-preserving dedupe that stops as soon as `n` unique ids are found."""
+    seen = set()
+    out: List[int] = []
+    for i in ids:
+        if i in seen:
+            continue
+        seen.add(i)
+        out.append(i)
+        if len(out) == n:
+            break
+    return out
+ 
+ 
+def warm_up_search():
+    """
+    Run one tiny query per collection so the embedding model and the HNSW
+    index pages are loaded before the first real user query.
+    Called once when this module is imported (serving path only).
+    """
+    emb = embed_query("warm up")
+    for collection in (sections_collection, acts_collection):
+        if collection.count():
+            collection.query(query_embeddings=[emb], n_results=1, include=["distances"])
+ 
+ 
+ 
 def rrf_fuse(
-    vector_results: List[Dict[str, Any]],
-    lexical_results: List[Dict[str, Any]],
+    vector_ids: Iterable[int],
+    lexical_ids: Iterable[int],
     k_rrf: int = 60,
     top_k: int = 15,
 ) -> List[int]:
     """
     Reciprocal Rank Fusion over vector + lexical results.
-    Returns top_k Neo4j section ids.
+    Takes the ranked Neo4j section ids of each retriever (RRF only needs rank
+    positions, not scores). Returns top_k Neo4j section ids.
     """
-    scores: Dict[int, float] = defaultdict(float)
+    scores: Dict[int, float] = {}
+ 
+    for ranked in (vector_ids, lexical_ids):
+        for rank, sid in enumerate(ranked):
+            scores[sid] = scores.get(sid, 0.0) + 1.0 / (k_rrf + rank + 1)
  
-    for rank, r in enumerate(vector_results):
-        sid = r["sid"]
-        scores[sid] += 1.0 / (k_rrf + rank + 1)
+    # only top_k are needed: O(n log top_k), same tie order as sorted()
+    fused = nlargest(top_k, scores.items(), key=lambda x: x[1])
+    return [sid for sid, _ in fused]
  
-    for rank, r in enumerate(lexical_results):
-        sid = r["sid"]
-        scores[sid] += 1.0 / (k_rrf + rank + 1)
  
-    fused = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    return [sid for sid, _ in fused[:top_k]]
+# Load model + HNSW pages at import so the first user query isn't the slow one
+warm_up_search()
  
\ No newline at end of file
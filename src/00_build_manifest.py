@@ -1,38 +1,59 @@
 # src/00_build_manifest.py
 import csv
-from pathlib import Path
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from config import ACTS_ROOT, MANIFEST_PATH
 
+FIELDNAMES = ["act_id", "year", "seq", "file_path", "act_title", "status"]
+
+
+# "<seq>.pdf"; anything else in a year folder is not an act
+PDF_NAME_RE = re.compile(r"^(\d+)\.pdf$", re.IGNORECASE)
+
+
+def scan_year(year_entry):
+    """All (seq, path) pairs in one year folder, sorted by seq."""
+    with os.scandir(year_entry.path) as it:
+        pdfs = [
+            (int(m.group(1)), e.path)
+            for e in it
+            if (m := PDF_NAME_RE.match(e.name)) and e.is_file()
+        ]
+    pdfs.sort()
+    return pdfs
+
+
 def build_manifest():
     rows = []
-    for year_dir in sorted(ACTS_ROOT.iterdir()):
-        if not year_dir.is_dir():
-            continue
-        try:
-            year = int(year_dir.name)
-        except ValueError:
-            continue
-
-        for pdf_file in sorted(year_dir.glob("*.pdf"), key=lambda p: int(p.stem)):
-            seq = int(pdf_file.stem)
-            act_id = f"{year}_{seq}"
-            rows.append({
-                "act_id": act_id,
-                "year": year,
-                "seq": seq,
-                "file_path": str(pdf_file),
-                "act_title": "",        # filled later if you want
-                "status": "raw"
-            })
 
-    with MANIFEST_PATH.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=["act_id", "year", "seq", "file_path", "act_title", "status"]
+    # os.scandir: one directory read per level, is_dir/is_file come from the
+    # cached entry instead of a stat() per path
+    with os.scandir(ACTS_ROOT) as it:
+        year_entries = sorted(
+            (e for e in it if e.is_dir() and e.name.isdigit()),
+            key=lambda e: e.name,
         )
+
+    # one readdir per year folder, run concurrently: on a network share each
+    # listing is latency bound, and the GIL is released while scandir waits
+    with ThreadPoolExecutor(max_workers=32) as ex:
+        for year_entry, pdfs in zip(year_entries, ex.map(scan_year, year_entries)):
+            year = int(year_entry.name)
+            for seq, path in pdfs:
+                rows.append({
+                    "act_id": f"{year}_{seq}",
+                    "year": year,
+                    "seq": seq,
+                    "file_path": path,
+                    "act_title": "",        # filled later if you want
+                    "status": "raw"
+                })
+
+    with MANIFEST_PATH.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
         writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+        writer.writerows(rows)
 
     print(f"Wrote manifest with {len(rows)} rows to {MANIFEST_PATH}")
 
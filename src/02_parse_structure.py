@@ -1,61 +1,70 @@
 # src/02_parse_structure.py
 
-import json
 import csv
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from config import MANIFEST_PATH, LINES_DIR, SECTIONS_DIR
+from typing import Iterable, Iterator
+
+import orjson
+
+from config import MANIFEST_PATH, LINES_DIR, SECTIONS_DIR, KEEP_RAW_LINES
 
 SECTION_PATTERNS = [
     re.compile(r"^Section\s+(\d+[A-Za-z]?)\.?\s*(.*)$"),
     re.compile(r"^(\d+[A-Za-z]?)\.\s+(.*)$"),
 ]
+SECTION_WORD_PATTERN, NUMBERED_PATTERN = SECTION_PATTERNS
 
 CHAPTER_PATTERN = re.compile(r"^CHAPTER\s+([IVXLC]+)\b")
 
 
 def detect_section_header(text: str):
-    for pat in SECTION_PATTERNS:
-        m = pat.match(text)
-        if m:
-            section_num = m.group(1)
-            heading = m.group(2).strip()
-            return section_num, heading
+    # runs on every line: a cheap prefix check decides which regex (if any)
+    # can possibly match, so ordinary body lines never reach the regex engine
+    if not text:
+        return None, None
+    c = text[0]
+    if c == "S" and text.startswith("Section"):
+        m = SECTION_WORD_PATTERN.match(text)
+    elif c.isdigit():
+        m = NUMBERED_PATTERN.match(text)
+    else:
+        return None, None
+    if m:
+        section_num = m.group(1)
+        heading = m.group(2).strip()
+        return section_num, heading
     return None, None
 
 
 def detect_chapter(text: str):
+    if not text.startswith("CHAPTER"):
+        return None
     m = CHAPTER_PATTERN.match(text)
     if m:
         return m.group(1)
     return None
 
 
-def process_act(row):
-    act_id = row["act_id"]
-    year = int(row["year"])
-    seq = int(row["seq"])
-
-    in_path = LINES_DIR / str(year) / f"{act_id}_lines.jsonl"
-    out_dir = SECTIONS_DIR / str(year)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_path = out_dir / f"{act_id}_sections.jsonl"
-
+def iter_sections(lines: Iterable[dict], act_id: str, year: int, seq: int) -> Iterator[dict]:
+    """Group line records (stage 01 output) into section records."""
     current_chapter = None
     current_section = None
     current_heading = ""
-    buffer = []
-    pages = set()
-    raw_lines = []
+    # parallel per-line buffers for the current section (no per-line dicts);
+    # pages and raw_lines are derived from them only when the section is built
+    texts: list[str] = []
+    page_idxs: list[int] = []
+    line_idxs: list[int] = []
 
-    def flush_section(outfile):
-        nonlocal buffer, pages, raw_lines, current_section, current_heading
+    def build_section():
         if current_section is None:
-            return
+            return None
 
-        text = "\n".join(l["text"] for l in buffer)
+        text = "\n".join(texts)
         if not text.strip():
-            return
+            return None
 
         record = {
             "act_id": act_id,
@@ -73,58 +82,75 @@ def process_act(row):
             "citation": f"Section {current_section}",
             "heading": current_heading or None,
             "text": text,
-            "pages": sorted(pages),
-            "raw_lines": raw_lines,
+            "pages": sorted(set(page_idxs)),
         }
+        if KEEP_RAW_LINES:
+            record["raw_lines"] = [
+                {"page": p, "line_index": li, "text": t}
+                for p, li, t in zip(page_idxs, line_idxs, texts)
+            ]
+        return record
 
-        outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
+    # -------- RUN THE PARSER --------
+    for rec in lines:
+        t = rec["text"]
+
+        chap = detect_chapter(t)
+        if chap:
+            current_chapter = chap
+            continue
+
+        sec_num, heading = detect_section_header(t)
+        if sec_num:
+            record = build_section()
+            if record:
+                yield record
+            current_section = sec_num
+            current_heading = heading
+            texts = []
+            page_idxs = []
+            line_idxs = []
+            continue
 
-        buffer = []
-        pages = set()
-        raw_lines = []
+        if current_section is None:
+            continue  # ignore preamble for now
 
-    # -------- RUN THE PARSER --------
-    with in_path.open(encoding="utf-8") as f_in, out_path.open("w", encoding="utf-8") as f_out:
-        for line in f_in:
-            rec = json.loads(line)
-            t = rec["text"]
-
-            chap = detect_chapter(t)
-            if chap:
-                current_chapter = chap
-                continue
-
-            sec_num, heading = detect_section_header(t)
-            if sec_num:
-                flush_section(f_out)
-                current_section = sec_num
-                current_heading = heading
-                buffer = []
-                pages = set()
-                raw_lines = []
-                continue
-
-            if current_section is None:
-                continue  # ignore preamble for now
-
-            buffer.append(rec)
-            pages.add(rec["page"])
-            raw_lines.append({
-                "page": rec["page"],
-                "line_index": rec["line_index"],
-                "text": rec["text"]
-            })
-
-        flush_section(f_out)
-
-    print(f"{act_id}: sections written to {out_path}")
+        texts.append(t)
+        page_idxs.append(rec["page"])
+        line_idxs.append(rec["line_index"])
+
+    record = build_section()
+    if record:
+        yield record
+
+
+def process_act(row: dict) -> str:
+    act_id = row["act_id"]
+    year = int(row["year"])
+    seq = int(row["seq"])
+
+    in_path = LINES_DIR / str(year) / f"{act_id}_lines.jsonl"
+    out_dir = SECTIONS_DIR / str(year)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = out_dir / f"{act_id}_sections.jsonl"
+
+    # binary I/O: orjson reads/writes UTF-8 bytes directly
+    with in_path.open("rb") as f_in, out_path.open("wb") as f_out:
+        for record in iter_sections(map(orjson.loads, f_in), act_id, year, seq):
+            f_out.write(orjson.dumps(record))
+            f_out.write(b"\n")
+
+    return f"{act_id}: sections written to {out_path}"
 
 
 def main():
     with MANIFEST_PATH.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            process_act(row)
+        rows = list(csv.DictReader(f))
+
+    # acts have disjoint input/output files -> one process per core, no locking
+    with ProcessPoolExecutor() as ex:
+        for msg in ex.map(process_act, rows, chunksize=8):
+            print(msg)
 
 
 if __name__ == "__main__":
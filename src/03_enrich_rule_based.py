@@ -1,24 +1,60 @@
 # src/03_enrich_rule_based.py
 
-import json
 import csv
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator
+
+import orjson
+
 from config import MANIFEST_PATH, SECTIONS_DIR, ENRICHED_DIR
 
-SECTION_CITE_RE = re.compile(r"\bsections?\s+\d+[A-Za-z]*(?:\s*,\s*\d+[A-Za-z]*)*")
 ACT_CITE_RE = re.compile(r"\b([A-Z][A-Za-z\s]+ Act,\s*\d{4})\b")
+
+SECTION_CITE_RE = re.compile(r"\bsections?\s+\d+[A-Za-z]*(?:\s*,\s*\d+[A-Za-z]*)*")
 DEFINITION_RE = re.compile(r"\"([^\"]+)\"\s+(means|includes)\s+", re.IGNORECASE)
-AMENDMENT_RE = re.compile(r"is hereby (repealed|substituted|omitted)", re.IGNORECASE)
-NOTWITH_RE = re.compile(r"notwithstanding anything contained in", re.IGNORECASE)
+
+# Only patterns whose matches can never overlap share a pass (dispatch on
+# m.lastgroup). Everything else keeps its own finditer: a quoted defined term
+# or a greedy act title can contain a section cite, and a section cite's
+# trailing [A-Za-z]* can run into "is hereby ..." / "notwithstanding ...";
+# in one alternation the first match would hide the others.
+COMBINED_RE = re.compile(
+    r"(?P<amend>is hereby (?P<amend_type>repealed|substituted|omitted))"
+    r"|(?P<nw>notwithstanding anything contained in)",
+    re.IGNORECASE,
+)
 
 
 def enrich(sec: dict) -> dict:
     text = sec["text"]
 
     citations = []
+    defined_terms = []
+    amendments = []
+    precedence_clauses = []
+
     for m in SECTION_CITE_RE.finditer(text):
         citations.append({"kind": "section", "raw": m.group(0), "normalized": {}})
+
+    for m in DEFINITION_RE.finditer(text):
+        defined_terms.append({"term": m.group(1), "definition_span": m.group(0)})
+
+    # bind appends once; this loop runs over every match in every section
+    add_amend = amendments.append
+    add_prec = precedence_clauses.append
+
+    for m in COMBINED_RE.finditer(text):
+        if m.lastgroup == "amend":
+            add_amend({
+                "type": m.group("amend_type").lower(),
+                "raw": m.group(0),
+                "target_text": None
+            })
+        else:
+            add_prec({"kind": "notwithstanding", "raw": m.group(0)})
+
     for m in ACT_CITE_RE.finditer(text):
         citations.append({
             "kind": "act",
@@ -26,22 +62,6 @@ def enrich(sec: dict) -> dict:
             "normalized": {"title": m.group(1)}
         })
 
-    defined_terms = [{
-        "term": m.group(1),
-        "definition_span": m.group(0)
-    } for m in DEFINITION_RE.finditer(text)]
-
-    amendments = [{
-        "type": m.group(1).lower(),
-        "raw": m.group(0),
-        "target_text": None
-    } for m in AMENDMENT_RE.finditer(text)]
-
-    precedence_clauses = [{
-        "kind": "notwithstanding",
-        "raw": m.group(0)
-    } for m in NOTWITH_RE.finditer(text)]
-
     sec["citations"] = citations
     sec["defined_terms"] = defined_terms
     sec["amendments"] = amendments
@@ -64,7 +84,12 @@ def enrich(sec: dict) -> dict:
     return sec
 
 
-def process_act(row: dict) -> None:
+def iter_enriched(sections: Iterable[dict]) -> Iterator[dict]:
+    for sec in sections:
+        yield enrich(sec)
+
+
+def process_act(row: dict) -> str:
     act_id = row["act_id"]
     year = int(row["year"])
 
@@ -73,22 +98,24 @@ def process_act(row: dict) -> None:
     out_dir.mkdir(parents=True, exist_ok=True)
     out_path = out_dir / f"{act_id}_enriched.jsonl"
 
-    with in_path.open(encoding="utf-8") as f_in, \
-         out_path.open("w", encoding="utf-8") as f_out:
+    # binary I/O: orjson reads/writes UTF-8 bytes directly
+    with in_path.open("rb") as f_in, out_path.open("wb") as f_out:
+        for sec in iter_enriched(map(orjson.loads, f_in)):
+            f_out.write(orjson.dumps(sec))
+            f_out.write(b"\n")
 
-        for line in f_in:
-            sec = json.loads(line)
-            sec = enrich(sec)
-            f_out.write(json.dumps(sec, ensure_ascii=False) + "\n")
-
-    print(f"{act_id}: enriched -> {out_path}")
+    return f"{act_id}: enriched -> {out_path}"
 
 
 def main() -> None:
     with MANIFEST_PATH.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            process_act(row)
+        rows = list(csv.DictReader(f))
+
+    # acts have disjoint input/output files -> one process per core, no locking;
+    # per-act work is cheap, so larger chunks to amortize IPC
+    with ProcessPoolExecutor() as ex:
+        for msg in ex.map(process_act, rows, chunksize=16):
+            print(msg)
 
 
 if __name__ == "__main__":
@@ -1,18 +1,21 @@
 # src/04_enrich_llm_hybrid.py
+import asyncio
 import json
 import csv
 import re
 import os
-import time
+import random
 from pathlib import Path
 
-from openai import OpenAI  # OpenRouter uses OpenAI-compatible client
+import orjson
+from openai import AsyncOpenAI, RateLimitError  # OpenRouter uses OpenAI-compatible client
 
-from config import MANIFEST_PATH, ENRICHED_DIR, KG_READY_DIR
+from config import MANIFEST_PATH, ENRICHED_DIR, KG_READY_DIR, WRITE_BUFFER_SIZE
+from llm_cache import cache_salt, llm_cache_get, llm_cache_key, llm_cache_put, open_llm_cache
 
 # ---------- OpenRouter CLIENT SETUP ----------
 
-client = OpenAI(
+client = AsyncOpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=os.getenv("OPENROUTER_API_KEY"),
 )
@@ -20,8 +23,18 @@ client = OpenAI(
 # pick a good model hosted on OpenRouter
 MODEL = "deepseek/deepseek-chat"
 
-# number of sections per LLM call
-BATCH_SIZE = 5
+# Sections per LLM call are packed by size rather than a fixed count: short
+# sections fill a call up to the token budget, long ones get fewer per call.
+# Tokens are estimated as characters / CHARS_PER_TOKEN.
+BATCH_TOKEN_BUDGET = 3000
+MAX_BATCH_SIZE = 16
+CHARS_PER_TOKEN = 4
+
+# batches in flight at once (keep under the OpenRouter per-key limit)
+MAX_CONCURRENCY = 8
+
+# retries on 429 before a batch is given up
+MAX_RETRIES = 5
 
 
 # ---------- HELPER: sentence selection ----------
@@ -29,37 +42,93 @@ BATCH_SIZE = 5
 SENTENCE_SPLIT_RE = re.compile(r"(?<=[.?!])\s+")
 
 KEYWORDS = [
-    " shall ",
-    " shall be bound ",
-    " may ",
-    " punishable ",
-    " liable ",
-    " offence ",
-    " offense ",
+    "shall",
+    "may",
+    "punishable",
+    "liable",
+    "offence",
+    "offense",
 ]
 
+# one C-level scan over the whole section instead of a Python loop over
+# KEYWORDS. (?<!\S)/(?!\S) mirror the old " kw " padding: whole words between
+# whitespace/string ends, so "shall," still doesn't count.
+KEYWORD_RE = re.compile(
+    r"(?<!\S)(?:" + "|".join(KEYWORDS) + r")(?!\S)",
+    re.IGNORECASE,
+)
 
-def find_candidate_sentences(text: str, max_sentences: int = 8):
+
+def find_candidate_sentences(
+    text: str,
+    max_sentences: int = 8,
+    max_chars: int = BATCH_TOKEN_BUDGET * CHARS_PER_TOKEN,
+):
     """Return a list of 'interesting' sentences for the LLM."""
-    sentences = SENTENCE_SPLIT_RE.split(text)
+    # max_chars: stop once the picked sentences alone would fill a whole batch
+    # (run-on sections where the splitter finds few sentence breaks)
+    # one lazy sweep over keyword hits and sentence breaks together: sections
+    # without a hit return after a single keyword scan, and both scans stop
+    # at the last sentence we need instead of running to the end of `text`
+    hits = KEYWORD_RE.finditer(text)
+    hit = next(hits, None)
+    if hit is None:
+        return []
+
     cand = []
-    for s in sentences:
-        ls = " " + s.lower() + " "
-        if any(k in ls for k in KEYWORDS):
-            s_clean = s.strip()
+    used = 0
+    start = 0
+    for m in SENTENCE_SPLIT_RE.finditer(text):
+        if hit.start() < m.start():
+            s_clean = text[start:m.start()].strip()
             if s_clean:
                 cand.append(s_clean)
-        if len(cand) >= max_sentences:
-            break
+                used += len(s_clean)
+                if len(cand) >= max_sentences or used >= max_chars:
+                    return cand
+            # other keywords in the same sentence
+            while hit is not None and hit.start() < m.end():
+                hit = next(hits, None)
+            if hit is None:
+                return cand
+        start = m.end()
+
+    # remaining hit is in the tail after the last split point
+    s_clean = text[start:].strip()
+    if s_clean:
+        cand.append(s_clean)
     return cand
 
 
+def entry_tokens(entry) -> int:
+    """Rough input-token estimate for one section's candidate sentences."""
+    return sum(len(s) for s in entry["sentences"]) // CHARS_PER_TOKEN
+
+
+def pack_batches(entries):
+    """Group LLM inputs into batches of at most BATCH_TOKEN_BUDGET / MAX_BATCH_SIZE."""
+    batch, tokens = [], 0
+    for entry in entries:
+        n = entry_tokens(entry)
+        if batch and (tokens + n > BATCH_TOKEN_BUDGET or len(batch) >= MAX_BATCH_SIZE):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(entry)
+        tokens += n
+    if batch:
+        yield batch
+
+
 # ---------- LLM: batched call via OpenRouter ----------
 
-PROMPT_TEMPLATE_BATCH = """
-You are a legal information extraction system for Indian statutes.
+# Everything that is the same for every call lives in the system message: it is
+# a byte-identical prefix on every request, so providers with prefix caching
+# (DeepSeek does this automatically) bill it as cached input tokens. The user
+# message only carries the sections.
+SYSTEM_SCHEMA = """You are a structured legal information extractor for Indian statutes.
+You MUST respond with valid JSON only, matching the schema below.
 
-For EACH SECTION below, extract the following information:
+For EACH SECTION in the user message, extract the following information:
 
 - roles: distinct entities who act in the law (e.g. "District Magistrate", "keeper of a sarai").
 - obligations: duties that MUST be performed.
@@ -69,53 +138,54 @@ For EACH SECTION below, extract the following information:
 
 Return STRICT JSON **array**. Each element corresponds to ONE section and must have schema:
 
-{{
+{
   "section_index": <integer index exactly as given>,
   "roles": ["role1", "role2", ...],
   "obligations": [
-    {{
+    {
       "actor": "string",
       "action": "string",
       "conditions": "string or null",
       "source_span": "exact sentence or phrase"
-    }}
+    }
   ],
   "powers": [
-    {{
+    {
       "actor": "string",
       "action": "string",
       "conditions": "string or null",
       "source_span": "exact sentence or phrase"
-    }}
+    }
   ],
   "penalties": [
-    {{
+    {
       "subject": "string",
       "description": "string",
       "imprisonment": "string or null",
       "fine_amount": "number or null",
       "source_span": "exact sentence or phrase"
-    }}
+    }
   ],
   "rights": [
-    {{
+    {
       "holder": "string",
       "description": "string",
       "conditions": "string or null",
       "source_span": "exact sentence or phrase"
-    }}
+    }
   ]
-}}
+}
 
 If something is not present for a section, use empty lists.
+"""
 
-SECTIONS (each starts with 'SECTION <index>'):
+USER_TEMPLATE = """SECTIONS (each starts with 'SECTION <index>'):
 
 {sections_block}
 """
 
 
-def call_llm_batch(batch_inputs):
+async def call_llm_batch(batch_inputs):
     """
     batch_inputs: list of dicts:
         {"section_index": int, "sentences": [str, ...]}
@@ -135,64 +205,69 @@ def call_llm_batch(batch_inputs):
         blocks.append(block)
 
     sections_block = "\n\n".join(blocks)
-    prompt = PROMPT_TEMPLATE_BATCH.format(sections_block=sections_block)
-
-    try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a structured legal information extractor. "
-                        "You MUST respond with valid JSON only, matching the requested schema."
-                    ),
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0,
-            extra_body={"response_format": {"type": "json_object"}},
-        )
-
-        message = response.choices[0].message
-        text = message.content
-
-        if not text or not isinstance(text, str):
-            return {}
+    prompt = USER_TEMPLATE.format(sections_block=sections_block)
 
+    for attempt in range(MAX_RETRIES):
         try:
-            parsed = json.loads(text)
+            response = await client.chat.completions.create(
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_SCHEMA},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0,
+                extra_body={"response_format": {"type": "json_object"}},
+            )
+            break
+        except RateLimitError:
+            # exponential backoff with jitter so parallel batches don't retry in lockstep
+            await asyncio.sleep(min(2 ** attempt, 30) + random.random())
         except Exception as e:
-            print("LLM JSON parse error:", type(e).__name__, e)
+            print("OpenRouter LLM batch error:", type(e).__name__, e)
             return {}
+    else:
+        print(f"OpenRouter rate limit: giving up on batch after {MAX_RETRIES} tries")
+        return {}
 
-        if not isinstance(parsed, list):
-            parsed = [parsed]
-
-        out = {}
-        for item in parsed:
-            if not isinstance(item, dict):
-                continue
-            idx = item.get("section_index")
-            if idx is None:
-                continue
-
-            out[idx] = {
-                "roles": item.get("roles") or [],
-                "obligations": item.get("obligations") or [],
-                "powers": item.get("powers") or [],
-                "penalties": item.get("penalties") or [],
-                "rights": item.get("rights") or [],
-            }
+    message = response.choices[0].message
+    text = message.content
 
-        return out
+    if not text or not isinstance(text, str):
+        return {}
 
+    try:
+        parsed = json.loads(text)
     except Exception as e:
-        print("OpenRouter LLM batch error:", type(e).__name__, e)
-        # gentle backoff if rate-limited
-        time.sleep(1.0)
+        print("LLM JSON parse error:", type(e).__name__, e)
         return {}
 
+    if not isinstance(parsed, list):
+        parsed = [parsed]
+
+    out = {}
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        idx = item.get("section_index")
+        if idx is None:
+            continue
+
+        out[idx] = {
+            "roles": item.get("roles") or [],
+            "obligations": item.get("obligations") or [],
+            "powers": item.get("powers") or [],
+            "penalties": item.get("penalties") or [],
+            "rights": item.get("rights") or [],
+        }
+
+    return out
+
+
+# ---------- LLM RESULT CACHE ----------
+# see llm_cache.py; keys are salted with this stage's model + prompts
+
+_CACHE_SALT = cache_salt(MODEL, SYSTEM_SCHEMA, USER_TEMPLATE)
+
 
 # ---------- MERGE INTO SECTION ----------
 
@@ -221,7 +296,7 @@ def merge_semantics(sec, llm_result):
 
 # ---------- MAIN PER-ACT PROCESS ----------
 
-def process_act(row):
+async def process_act(row, sem, cache):
     act_id = row["act_id"]
     year = int(row["year"])
 
@@ -241,28 +316,52 @@ def process_act(row):
 
     # Load all sections
     sections = []
-    with in_path.open(encoding="utf-8") as f_in:
+    with in_path.open("rb") as f_in:
         for line in f_in:
-            sections.append(json.loads(line))
+            sections.append(orjson.loads(line))
 
-    # Build LLM inputs
+    # Build LLM inputs (cache hits and in-act duplicates never reach the LLM)
+    results_by_index = {}
     llm_inputs = []
+    pending = {}  # cache key -> section indexes waiting on that LLM result
     for idx, sec in enumerate(sections):
         candidates = find_candidate_sentences(sec["text"])
         if candidates:
-            llm_inputs.append({"section_index": idx, "sentences": candidates})
+            key = llm_cache_key(_CACHE_SALT, candidates)
+            hit = llm_cache_get(cache, key)
+            if hit is not None:
+                results_by_index[idx] = hit
+            elif key in pending:
+                pending[key].append(idx)
+            else:
+                pending[key] = [idx]
+                llm_inputs.append({"section_index": idx, "sentences": candidates})
         else:
             meta = sec.get("processing_meta", {}) or {}
             meta["llm_used"] = False
             meta["llm_model"] = None
             sec["processing_meta"] = meta
 
-    # Call LLM in batches
-    results_by_index = {}
-    for i in range(0, len(llm_inputs), BATCH_SIZE):
-        batch = llm_inputs[i : i + BATCH_SIZE]
-        batch_result = call_llm_batch(batch)
-        results_by_index.update(batch_result)
+    # Call LLM in batches, up to MAX_CONCURRENCY in flight
+    batches = list(pack_batches(llm_inputs))
+
+    async def bounded(batch):
+        async with sem:
+            return await call_llm_batch(batch)
+
+    llm_results = {}
+    for batch_result in await asyncio.gather(*(bounded(b) for b in batches)):
+        llm_results.update(batch_result)
+
+    # only store what the LLM actually answered; failed batches retry next run
+    for key, idxs in pending.items():
+        res = llm_results.get(idxs[0])
+        if res is None:
+            continue
+        for idx in idxs:
+            results_by_index[idx] = res
+        llm_cache_put(cache, key, res)
+    cache.commit()
 
     # Merge results back
     for idx, sec in enumerate(sections):
@@ -271,22 +370,30 @@ def process_act(row):
         sections[idx] = sec
 
     # Write KG-ready file
-    with out_path.open("w", encoding="utf-8") as f_out:
+    with out_path.open("wb", buffering=WRITE_BUFFER_SIZE) as f_out:
         for sec in sections:
-            f_out.write(json.dumps(sec, ensure_ascii=False) + "\n")
+            f_out.write(orjson.dumps(sec))
+            f_out.write(b"\n")
 
     print(f"{act_id}: KG-ready -> {out_path}")
 
 
-def main():
-    with MANIFEST_PATH.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # optional: only newer years while experimenting
-            if int(row["year"]) < 2010:
-                continue
-            process_act(row)
+async def main():
+    # one semaphore for the whole run -> global cap on concurrent requests
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    cache = open_llm_cache()
+
+    try:
+        with MANIFEST_PATH.open(newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                # optional: only newer years while experimenting
+                if int(row["year"]) < 2010:
+                    continue
+                await process_act(row, sem, cache)
+    finally:
+        cache.close()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -7,22 +7,42 @@ Input:  data/enriched/<year>/<act_id>_enriched.jsonl
 Output: data/kg_ready/<year>/<act_id>_kg.jsonl
 """
 
+import asyncio
+import hashlib
 import json
 import csv
 import re
 import os
-import time
 from pathlib import Path
 
 import ollama  # pip install ollama
+import orjson
 
-from config import MANIFEST_PATH, ENRICHED_DIR, KG_READY_DIR
+from config import MANIFEST_PATH, ENRICHED_DIR, KG_READY_DIR, WRITE_BUFFER_SIZE
 
 
 # ---------- LLM CONFIG ----------
 
 MODEL = "qwen2.5:7b-instruct"  # make sure you ran: `ollama pull qwen2.5:7b-instruct`
-BATCH_SIZE = 5  # number of sections per LLM call
+
+# Sections per LLM call are packed by size rather than a fixed count: short
+# sections fill a call up to the token budget, long ones get fewer per call.
+# Tokens are estimated as characters / CHARS_PER_TOKEN.
+BATCH_TOKEN_BUDGET = 3000
+MAX_BATCH_SIZE = 8
+CHARS_PER_TOKEN = 4
+
+# requests in flight at once; match the server's OLLAMA_NUM_PARALLEL so every
+# slot is busy (Ollama batches concurrent requests) without queueing on its side
+MAX_CONCURRENCY = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+# one client for the whole run: its httpx pool keeps connections to the server
+# alive between batches instead of reconnecting per call. Long timeout because
+# a batch can queue behind MAX_CONCURRENCY others on a busy GPU.
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+
+client = ollama.AsyncClient(host=OLLAMA_HOST, timeout=OLLAMA_TIMEOUT)
 
 
 # ---------- SENTENCE SELECTION ----------
@@ -31,37 +51,79 @@ SENTENCE_SPLIT_RE = re.compile(r"(?<=[.?!])\s+")
 
 # you can tune this list to adjust how many sections trigger LLM calls
 KEYWORDS = [
-    " shall ",
-    " shall be bound ",
-    " may ",
-    " punishable ",
-    " liable ",
-    " offence ",
-    " offense ",
+    "shall",
+    "may",
+    "punishable",
+    "liable",
+    "offence",
+    "offense",
 ]
 
+# All keywords in one compiled alternation, run once over the whole
+# section. (?<!\S)/(?!\S) keep the old " kw " rule: whole words between
+# whitespace, so "shall," still doesn't count.
+KEYWORD_RE = re.compile(
+    r"(?<!\S)(?:" + "|".join(KEYWORDS) + r")(?!\S)",
+    re.IGNORECASE,
+)
 
-def find_candidate_sentences(text: str, max_sentences: int = 8):
+
+def find_candidate_sentences(
+    text: str,
+    max_sentences: int = 8,
+    max_chars: int = BATCH_TOKEN_BUDGET * CHARS_PER_TOKEN,
+):
     """Return a list of 'interesting' sentences for the LLM."""
-    sentences = SENTENCE_SPLIT_RE.split(text)
+    # max_chars: stop once the picked sentences alone would fill a whole batch
+    # (run-on sections where the splitter finds few sentence breaks)
+    # one lazy sweep over keyword hits and sentence breaks together: sections
+    # without a hit return after a single keyword scan, and both scans stop
+    # at the last sentence we need instead of running to the end of `text`
+    hits = KEYWORD_RE.finditer(text)
+    hit = next(hits, None)
+    if hit is None:
+        return []
+
     cand = []
-    for s in sentences:
-        ls = " " + s.lower() + " "
-        if any(k in ls for k in KEYWORDS):
-            s_clean = s.strip()
+    used = 0
+    start = 0
+    for m in SENTENCE_SPLIT_RE.finditer(text):
+        if hit.start() < m.start():
+            s_clean = text[start:m.start()].strip()
             if s_clean:
                 cand.append(s_clean)
-        if len(cand) >= max_sentences:
-            break
+                used += len(s_clean)
+                if len(cand) >= max_sentences or used >= max_chars:
+                    return cand
+            # other keywords in the same sentence
+            while hit is not None and hit.start() < m.end():
+                hit = next(hits, None)
+            if hit is None:
+                return cand
+        start = m.end()
+
+    # remaining hit is in the tail after the last split point
+    s_clean = text[start:].strip()
+    if s_clean:
+        cand.append(s_clean)
     return cand
 
 
+def entry_tokens(entry) -> int:
+    """Rough input-token estimate for one section's candidate sentences."""
+    return sum(len(s) for s in entry["sentences"]) // CHARS_PER_TOKEN
+
+
 # ---------- PROMPT TEMPLATE ----------
+# Everything that is the same for every call lives in the system message, so
+# each request starts with a byte-identical prefix and Ollama reuses its KV
+# cache for it instead of re-prefilling the instructions + schema every batch.
+# The user message only carries the sections.
 
-PROMPT_TEMPLATE_BATCH = """
-You are a legal information extraction system for Indian statutes.
+SYSTEM_SCHEMA = """You are a structured legal information extractor for Indian statutes.
+You MUST respond with valid JSON only, matching the schema below.
 
-For EACH SECTION below, extract the following information:
+For EACH SECTION in the user message, extract the following information:
 
 - roles: distinct entities who act in the law (e.g. "District Magistrate", "keeper of a sarai").
 - obligations: duties that MUST be performed.
@@ -69,57 +131,154 @@ For EACH SECTION below, extract the following information:
 - penalties: legal consequences like imprisonment, fine, etc.
 - rights: any explicit rights granted to persons.
 
-Return STRICT JSON **array**. Each element corresponds to ONE section and must have schema:
+The output is a JSON array. Each element corresponds to ONE section and has schema:
 
-{{
+{
   "section_index": <integer index exactly as given>,
   "roles": ["role1", "role2", ...],
   "obligations": [
-    {{
+    {
       "actor": "string",
       "action": "string",
       "conditions": "string or null",
       "source_span": "exact sentence or phrase"
-    }}
+    }
   ],
   "powers": [
-    {{
+    {
       "actor": "string",
       "action": "string",
       "conditions": "string or null",
       "source_span": "exact sentence or phrase"
-    }}
+    }
   ],
   "penalties": [
-    {{
+    {
       "subject": "string",
       "description": "string",
       "imprisonment": "string or null",
       "fine_amount": "number or null",
       "source_span": "exact sentence or phrase"
-    }}
+    }
   ],
   "rights": [
-    {{
+    {
       "holder": "string",
       "description": "string",
       "conditions": "string or null",
       "source_span": "exact sentence or phrase"
-    }}
+    }
   ]
-}}
+}
 
 If something is not present for a section, use empty lists.
 
-SECTIONS (each starts with 'SECTION <index>'):
+"""
+
+USER_TEMPLATE = """SECTIONS (each starts with 'SECTION <index>'):
 
 {sections_block}
 """
 
 
+# ---------- OUTPUT SCHEMA (grammar-constrained decoding) ----------
+# Same shape as SYSTEM_SCHEMA above. Passed as `format=` so Ollama can only sample
+# tokens that keep the output valid: no unparseable batches, no prose around
+# the JSON.
+
+_NULLABLE_STR = {"type": ["string", "null"]}
+
+
+def _obj(**props):
+    return {"type": "object", "properties": props, "required": list(props)}
+
+
+_ACTION_ITEM = _obj(
+    actor={"type": "string"},
+    action={"type": "string"},
+    conditions=_NULLABLE_STR,
+    source_span={"type": "string"},
+)
+
+EXTRACTION_SCHEMA = {
+    "type": "array",
+    "items": _obj(
+        section_index={"type": "integer"},
+        roles={"type": "array", "items": {"type": "string"}},
+        obligations={"type": "array", "items": _ACTION_ITEM},
+        powers={"type": "array", "items": _ACTION_ITEM},
+        penalties={"type": "array", "items": _obj(
+            subject={"type": "string"},
+            description={"type": "string"},
+            imprisonment=_NULLABLE_STR,
+            fine_amount={"type": ["number", "null"]},
+            source_span={"type": "string"},
+        )},
+        rights={"type": "array", "items": _obj(
+            holder={"type": "string"},
+            description={"type": "string"},
+            conditions=_NULLABLE_STR,
+            source_span={"type": "string"},
+        )},
+    ),
+}
+
+# older Ollama (< 0.5) only knows format="json"; flipped on first rejection
+_schema_format_supported = True
+
+LLM_OPTIONS = {
+    "temperature": 0,
+    # cap runaway generations; a full MAX_BATCH_SIZE batch fits, and
+    # schema + BATCH_TOKEN_BUDGET input + this still fit in num_ctx
+    "num_predict": 4096,
+    # fixed, so every request fits the same loaded context: a different num_ctx
+    # makes Ollama reload the model and drop the cached prefix
+    "num_ctx": 8192,
+}
+
+# keep the model (and its prefix cache) resident between batches/runs
+KEEP_ALIVE = -1
+
+
+# ---------- RERUN SKIP ----------
+# Each finished output section records a hash of its input line plus
+# everything that shapes the LLM answer. A rerun reuses the old output for
+# sections whose hash still matches and only sends new/changed ones to the
+# model; changing the model, prompt, schema or options invalidates everything.
+
+_INPUT_SALT = hashlib.blake2b(
+    b"\0".join([
+        MODEL.encode("utf-8"),
+        SYSTEM_SCHEMA.encode("utf-8"),
+        USER_TEMPLATE.encode("utf-8"),
+        orjson.dumps(EXTRACTION_SCHEMA),
+        orjson.dumps(LLM_OPTIONS),
+    ]),
+    digest_size=16,
+).digest()
+
+
+def input_hash(line: bytes) -> str:
+    return hashlib.blake2b(line, digest_size=16, key=_INPUT_SALT).hexdigest()
+
+
+def load_previous_output(out_path: Path) -> dict:
+    """input_hash -> finished section from an earlier run's output."""
+    prev = {}
+    with out_path.open("rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            sec = orjson.loads(line)
+            h = (sec.get("processing_meta") or {}).get("input_hash")
+            if h:
+                prev[h] = sec
+    return prev
+
+
 # ---------- LLM CALL (OLLAMA) ----------
 
-def call_llm_batch(batch_inputs):
+async def call_llm_batch(batch_inputs):
     """
     batch_inputs: list of dicts:
         { "section_index": int, "sentences": [str, ...] }
@@ -139,22 +298,36 @@ def call_llm_batch(batch_inputs):
         blocks.append(block)
 
     sections_block = "\n\n".join(blocks)
-    prompt = PROMPT_TEMPLATE_BATCH.format(sections_block=sections_block)
+    prompt = USER_TEMPLATE.format(sections_block=sections_block)
+
+    global _schema_format_supported
+
+    messages = [
+        {"role": "system", "content": SYSTEM_SCHEMA},
+        {"role": "user", "content": prompt},
+    ]
 
     try:
-        response = ollama.chat(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a structured legal information extractor. "
-                        "You MUST respond with valid JSON only, matching the requested schema."
-                    ),
-                },
-                {"role": "user", "content": prompt},
-            ],
-        )
+        try:
+            response = await client.chat(
+                model=MODEL,
+                messages=messages,
+                format=EXTRACTION_SCHEMA if _schema_format_supported else "json",
+                options=LLM_OPTIONS,
+                keep_alive=KEEP_ALIVE,
+            )
+        except ollama.ResponseError as e:
+            if not _schema_format_supported or "format" not in str(e).lower():
+                raise
+            print("Ollama rejected schema format, falling back to format='json':", e)
+            _schema_format_supported = False
+            response = await client.chat(
+                model=MODEL,
+                messages=messages,
+                format="json",
+                options=LLM_OPTIONS,
+                keep_alive=KEEP_ALIVE,
+            )
 
         text = response["message"]["content"]
 
@@ -192,7 +365,7 @@ def call_llm_batch(batch_inputs):
 
     except Exception as e:
         print("Ollama LLM batch error:", type(e).__name__, e)
-        time.sleep(0.2)
+        await asyncio.sleep(0.2)
         return {}
 
 
@@ -223,7 +396,7 @@ def merge_semantics(sec, llm_result):
 
 # ---------- PER-ACT PROCESSING ----------
 
-def process_act(row):
+async def process_act(row, sem):
     act_id = row["act_id"]
     year = int(row["year"])
 
@@ -236,64 +409,138 @@ def process_act(row):
         print(f"{act_id}: no enriched file at {in_path}, skipping")
         return
 
-    # Skip if we already have non-empty kg_ready (from earlier cloud runs, etc.)
+    # sections finished by an earlier run with the same input + model/prompt
+    previous = {}
     if out_path.exists() and out_path.stat().st_size > 0:
-        print(f"{act_id}: kg_ready already exists, skipping")
-        return
-
-    # Load all sections
-    sections = []
-    with in_path.open(encoding="utf-8") as f_in:
+        previous = load_previous_output(out_path)
+        if not previous:
+            # written before input hashes existed (earlier cloud runs, etc.):
+            # keep it as-is like we always did
+            print(f"{act_id}: kg_ready already exists, skipping")
+            return
+    reused = 0
+    hashed = 0      # sections written with an input_hash (reused / answered / no-LLM)
+
+    # Stream: read a section, queue it for the LLM if it looks interesting, and
+    # write finished sections as soon as everything before them is done.
+    # Memory is bounded by the batches in flight (plus sections stuck behind
+    # them in the reorder buffer), not by the size of the act; reading and
+    # writing overlap with LLM latency.
+    tmp_path = out_path.with_name(out_path.name + ".part")
+
+    ready = {}      # idx -> finished section waiting for its turn to be written
+    next_idx = 0    # next section index to write
+    tasks = []
+
+    # binary I/O: orjson reads/writes UTF-8 bytes directly
+    with in_path.open("rb") as f_in, tmp_path.open("wb", buffering=WRITE_BUFFER_SIZE) as f_out:
+
+        def flush_ready():
+            nonlocal next_idx
+            while next_idx in ready:
+                f_out.write(orjson.dumps(ready.pop(next_idx)))
+                f_out.write(b"\n")
+                next_idx += 1
+
+        async def run_batch(batch, batch_secs):
+            nonlocal hashed
+            # slot was taken by the reader before this task was created
+            try:
+                results = await call_llm_batch(batch)
+            finally:
+                sem.release()
+            for idx, (sec, h) in batch_secs.items():
+                if idx in results:
+                    sec = merge_semantics(sec, results[idx])
+                    # only answered sections count as done; failed batches retry next run
+                    sec["processing_meta"]["input_hash"] = h
+                    hashed += 1
+                ready[idx] = sec
+            flush_ready()
+
+        async def submit(batch, batch_secs):
+            # blocks the reader while MAX_CONCURRENCY batches are in flight
+            await sem.acquire()
+            tasks.append(asyncio.create_task(run_batch(batch, batch_secs)))
+            await asyncio.sleep(0)  # let the request go out before reading on
+
+        batch, batch_secs, batch_tokens = [], {}, 0
+        idx = 0
         for line in f_in:
-            if line.strip():
-                sections.append(json.loads(line))
+            line = line.strip()
+            if not line:
+                continue
+            h = input_hash(line)
+            if h in previous:
+                ready[idx] = previous[h]
+                reused += 1
+                hashed += 1
+                flush_ready()
+                idx += 1
+                continue
 
-    if not sections:
+            sec = orjson.loads(line)
+
+            candidates = find_candidate_sentences(sec["text"])
+            if candidates:
+                entry = {"section_index": idx, "sentences": candidates}
+                n = entry_tokens(entry)
+                # same packing rule as the token budget above: flush before
+                # this section would overflow the batch
+                if batch and batch_tokens + n > BATCH_TOKEN_BUDGET:
+                    await submit(batch, batch_secs)
+                    batch, batch_secs, batch_tokens = [], {}, 0
+                batch.append(entry)
+                batch_secs[idx] = (sec, h)
+                batch_tokens += n
+                if len(batch) >= MAX_BATCH_SIZE:
+                    await submit(batch, batch_secs)
+                    batch, batch_secs, batch_tokens = [], {}, 0
+            else:
+                # mark as no-LLM
+                meta = sec.get("processing_meta", {}) or {}
+                meta["llm_used"] = False
+                meta["llm_model"] = None
+                meta["input_hash"] = h
+                hashed += 1
+                sec["processing_meta"] = meta
+                ready[idx] = sec
+                flush_ready()
+            idx += 1
+
+        if batch:
+            await submit(batch, batch_secs)
+        await asyncio.gather(*tasks)
+        flush_ready()
+
+    if idx == 0:
+        tmp_path.unlink()
         print(f"{act_id}: enriched file empty, nothing to do")
         return
 
-    # Build LLM inputs for sections that look interesting
-    llm_inputs = []
-    for idx, sec in enumerate(sections):
-        candidates = find_candidate_sentences(sec["text"])
-        if candidates:
-            llm_inputs.append({"section_index": idx, "sentences": candidates})
-        else:
-            # mark as no-LLM
-            meta = sec.get("processing_meta", {}) or {}
-            meta["llm_used"] = False
-            meta["llm_model"] = None
-            sec["processing_meta"] = meta
-
-    # Call LLM in batches
-    results_by_index = {}
-    for i in range(0, len(llm_inputs), BATCH_SIZE):
-        batch = llm_inputs[i : i + BATCH_SIZE]
-        batch_result = call_llm_batch(batch)
-        results_by_index.update(batch_result)
-
-    # Merge back into sections
-    for idx, sec in enumerate(sections):
-        if idx in results_by_index:
-            sec = merge_semantics(sec, results_by_index[idx])
-        sections[idx] = sec
-
-    # Write KG-ready file
-    with out_path.open("w", encoding="utf-8") as f_out:
-        for sec in sections:
-            f_out.write(json.dumps(sec, ensure_ascii=False) + "\n")
-
-    print(f"{act_id}: KG-ready -> {out_path}")
-
-
-def main():
+    if hashed == 0:
+        # every batch failed: a file without any input_hash would look like a
+        # legacy output next run and the act would never be retried
+        tmp_path.unlink()
+        print(f"{act_id}: no section answered by the LLM, will retry next run")
+        return
+
+    # only a complete file gets the real name (the next run reuses from it)
+    tmp_path.replace(out_path)
+    print(f"{act_id}: KG-ready -> {out_path} ({reused}/{idx} sections reused)")
+
+
+async def main():
+    # one semaphore for the whole run -> global cap on concurrent requests
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
     with MANIFEST_PATH.open(newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         for row in reader:
             if int(row["year"]) < 1889:
                 continue
-            process_act(row)
+            await process_act(row, sem)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
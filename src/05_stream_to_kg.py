@@ -7,11 +7,13 @@ Builds the knowledge graph in Neo4j from:
 """
 
 import csv
-import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import orjson
 from neo4j import GraphDatabase
+from neo4j.exceptions import ClientError
 
 from config import MANIFEST_PATH, ENRICHED_DIR, KG_READY_DIR
 
@@ -23,188 +25,224 @@ NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "ds246@IISc")   # change or set env vars
 
 
-# ---------- Cypher write logic for a single section ----------
+# sections per write transaction (kept moderate so concurrent act writers
+# don't hold locks on shared Role/Act nodes for long)
+SECTION_BATCH_SIZE = 500
 
-def merge_section_tx(tx, sec: dict):
+# acts ingested in parallel, each on its own session. Concurrent MERGEs on the
+# shared Role/DefinedTerm nodes are only duplicate-free with uniqueness
+# constraints on :Label(id) in place, so main() drops to 1 if they're missing.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+
+# every node label this loader MERGEs on `id`
+NODE_LABELS = ("Act", "Section", "Role", "DefinedTerm", "Obligation", "Penalty")
+
+
+# ---------- schema: uniqueness constraints (index-backed MERGE/MATCH) ----------
+
+def ensure_schema(session) -> bool:
     """
-    Upsert Act, Section and semantic nodes/edges for one section dict.
+    Create a uniqueness constraint on `id` for every label we MERGE on, so
+    MATCH/MERGE (:Label {id: ...}) is an index seek instead of a label scan.
+    Returns False if any constraint could not be created (e.g. an older graph
+    already has duplicate ids); ingest still works, just without the guarantee.
     """
+    ok = True
+    for label in NODE_LABELS:
+        try:
+            session.run(
+                f"CREATE CONSTRAINT {label.lower()}_id IF NOT EXISTS "
+                f"FOR (n:{label}) REQUIRE n.id IS UNIQUE"
+            ).consume()
+        except ClientError as e:
+            print(f"could not create unique constraint on :{label}(id): {e.message}")
+            ok = False
+    return ok
+
+
+# ---------- Cypher write logic: Act + Section nodes, one UNWIND per batch ----------
+
+UPSERT_SECTIONS_Q = """
+UNWIND $rows AS row
+MERGE (a:Act {id: row.act_id})
+ON CREATE SET a.year = row.act_year
+ON MATCH  SET a.year = coalesce(a.year, row.act_year),
+              // 05 never writes a.title (08 does); keep the lowercased copy
+              // the act-title fallback matches on in step with whatever is there
+              a.title_lower = toLower(a.title)
+
+MERGE (s:Section {id: row.section_id})
+SET s.citation  = row.citation,
+    s.heading   = row.heading,
+    s.text      = row.text,
+    s.chapter   = row.chapter,
+    s.sectionNo = row.section_no,
+    s.pages     = row.pages,
+    s.has_llm   = row.has_llm,
+    // kept in step with Indexing.ensure_search_indexes (section_id_idx)
+    s.section_id_upper = toUpper(toString(row.section_no))
+
+MERGE (a)-[:HAS_SECTION]->(s)
+"""
 
-    act_id = sec["act_id"]
-    act_year = sec.get("act_year")
-    section_id = sec["section_id"]
-    citation = sec.get("citation")
-    heading = sec.get("heading")
-    text = sec.get("text")
 
+def section_row(sec: dict) -> dict:
+    """Flatten one section dict into the parameter row for UPSERT_SECTIONS_Q."""
     hierarchy = sec.get("hierarchy") or {}
-    chapter = hierarchy.get("chapter")
-    section_no = hierarchy.get("section")
-    pages = sec.get("pages") or []
-
     meta = sec.get("processing_meta") or {}
-    has_llm = bool(meta.get("llm_used"))
-
-    # 1) Act and Section
-    tx.run(
-        """
-        MERGE (a:Act {id: $act_id})
-        ON CREATE SET a.year = $act_year
-        ON MATCH  SET a.year = coalesce(a.year, $act_year)
-
-        MERGE (s:Section {id: $section_id})
-        SET s.citation  = $citation,
-            s.heading   = $heading,
-            s.text      = $text,
-            s.chapter   = $chapter,
-            s.sectionNo = $section_no,
-            s.pages     = $pages,
-            s.has_llm   = $has_llm
-
-        MERGE (a)-[:HAS_SECTION]->(s)
-        """,
-        act_id=act_id,
-        act_year=act_year,
-        section_id=section_id,
-        citation=citation,
-        heading=heading,
-        text=text,
-        chapter=chapter,
-        section_no=section_no,
-        pages=pages,
-        has_llm=has_llm,
-    )
+    return {
+        "act_id": sec["act_id"],
+        "act_year": sec.get("act_year"),
+        "section_id": sec["section_id"],
+        "citation": sec.get("citation"),
+        "heading": sec.get("heading"),
+        "text": sec.get("text"),
+        "chapter": hierarchy.get("chapter"),
+        "section_no": hierarchy.get("section"),
+        "pages": sec.get("pages") or [],
+        "has_llm": bool(meta.get("llm_used")),
+    }
+
+
+def merge_sections_tx(tx, secs: list[dict]):
+    """
+    Upsert a batch of sections in one transaction: all Act/Section nodes and
+    HAS_SECTION edges in a single UNWIND, then one UNWIND per semantic node
+    type for the whole batch.
+    """
+    tx.run(UPSERT_SECTIONS_Q, rows=[section_row(sec) for sec in secs])
+
+    terms, roles, obligations, penalties = semantic_rows(secs)
+    if terms:
+        tx.run(MERGE_TERMS_Q, rows=terms)
+    if roles:
+        tx.run(MERGE_ROLES_Q, rows=roles)
+    if obligations:
+        tx.run(MERGE_OBLIGATIONS_Q, rows=obligations)
+    if penalties:
+        tx.run(MERGE_PENALTIES_Q, rows=penalties)
+
+
+# ---------- Cypher write logic: semantic nodes, one UNWIND per node type ----------
+
+MERGE_TERMS_Q = """
+UNWIND $rows AS row
+MATCH (s:Section {id: row.section_id})
+MERGE (t:DefinedTerm {id: row.term_id})
+ON CREATE SET t.name = row.name, t.act_id = row.act_id
+MERGE (s)-[:DEFINES]->(t)
+"""
+
+MERGE_ROLES_Q = """
+UNWIND $rows AS row
+MATCH (s:Section {id: row.section_id})
+MERGE (r:Role {id: row.role_id})
+ON CREATE SET r.name = row.role_name
+MERGE (s)-[:MENTIONS_ROLE]->(r)
+"""
+
+# actor / subject edges only when one was extracted (FOREACH over a 0/1 list)
+MERGE_OBLIGATIONS_Q = """
+UNWIND $rows AS row
+MATCH (s:Section {id: row.section_id})
+MERGE (o:Obligation {id: row.obl_id})
+SET o.action      = row.action,
+    o.conditions  = row.conditions,
+    o.source_span = row.source_span
+MERGE (s)-[:IMPOSES_OBLIGATION]->(o)
+FOREACH (_ IN CASE WHEN row.actor_id IS NULL THEN [] ELSE [1] END |
+    MERGE (r:Role {id: row.actor_id})
+    ON CREATE SET r.name = row.actor
+    MERGE (o)-[:OBLIGATION_ON]->(r)
+)
+"""
+
+MERGE_PENALTIES_Q = """
+UNWIND $rows AS row
+MATCH (s:Section {id: row.section_id})
+MERGE (p:Penalty {id: row.pen_id})
+SET p.description  = row.description,
+    p.imprisonment = row.imprisonment,
+    p.fine_amount  = row.fine_amount,
+    p.source_span  = row.source_span
+MERGE (s)-[:PRESCRIBES_PENALTY]->(p)
+FOREACH (_ IN CASE WHEN row.subject_id IS NULL THEN [] ELSE [1] END |
+    MERGE (r:Role {id: row.subject_id})
+    ON CREATE SET r.name = row.subject
+    MERGE (p)-[:APPLIES_TO]->(r)
+)
+"""
 
-    # 2) Defined terms
-    for term in sec.get("defined_terms") or []:
-        name = (term.get("term") or "").strip()
-        if not name:
-            continue
-        term_id = f"{act_id}|{name.lower()}"
-
-        tx.run(
-            """
-            MATCH (s:Section {id: $section_id})
-            MERGE (t:DefinedTerm {id: $term_id})
-            ON CREATE SET t.name = $name, t.act_id = $act_id
-            MERGE (s)-[:DEFINES]->(t)
-            """,
-            section_id=section_id,
-            term_id=term_id,
-            name=name,
-            act_id=act_id,
-        )
-
-    # 3) Roles
-    roles = sec.get("roles") or []
-    for role_name in roles:
-        if not isinstance(role_name, str):
-            continue
-        clean = role_name.strip()
-        if not clean:
-            continue
-        role_id = clean.lower()
-
-        tx.run(
-            """
-            MATCH (s:Section {id: $section_id})
-            MERGE (r:Role {id: $role_id})
-            ON CREATE SET r.name = $role_name
-            MERGE (s)-[:MENTIONS_ROLE]->(r)
-            """,
-            section_id=section_id,
-            role_id=role_id,
-            role_name=clean,
-        )
-
-    # 4) Obligations
-    for idx, ob in enumerate(sec.get("obligations") or []):
-        if not isinstance(ob, dict):
-            continue
-
-        actor = (ob.get("actor") or "").strip()
-        action = ob.get("action")
-        conditions = ob.get("conditions")
-        source_span = ob.get("source_span")
-
-        obl_id = f"{section_id}|ob|{idx}"
-
-        tx.run(
-            """
-            MATCH (s:Section {id: $section_id})
-            MERGE (o:Obligation {id: $obl_id})
-            SET o.action      = $action,
-                o.conditions  = $conditions,
-                o.source_span = $source_span
-            MERGE (s)-[:IMPOSES_OBLIGATION]->(o)
-            """,
-            section_id=section_id,
-            obl_id=obl_id,
-            action=action,
-            conditions=conditions,
-            source_span=source_span,
-        )
-
-        if actor:
-            role_id = actor.lower()
-            tx.run(
-                """
-                MERGE (r:Role {id: $role_id})
-                ON CREATE SET r.name = $actor
-                MERGE (o:Obligation {id: $obl_id})-[:OBLIGATION_ON]->(r)
-                """,
-                role_id=role_id,
-                actor=actor,
-                obl_id=obl_id,
-            )
-
-    # 5) Penalties
-    for idx, pen in enumerate(sec.get("penalties") or []):
-        if not isinstance(pen, dict):
-            continue
-
-        subject = (pen.get("subject") or "").strip()
-        description = pen.get("description")
-        imprisonment = pen.get("imprisonment")
-        fine_amount = pen.get("fine_amount")
-        source_span = pen.get("source_span")
-
-        fine_str = None
-        if fine_amount is not None:
-            fine_str = str(fine_amount)
-
-        pen_id = f"{section_id}|pen|{idx}"
-
-        tx.run(
-            """
-            MATCH (s:Section {id: $section_id})
-            MERGE (p:Penalty {id: $pen_id})
-            SET p.description  = $description,
-                p.imprisonment = $imprisonment,
-                p.fine_amount  = $fine_amount,
-                p.source_span  = $source_span
-            MERGE (s)-[:PRESCRIBES_PENALTY]->(p)
-            """,
-            section_id=section_id,
-            pen_id=pen_id,
-            description=description,
-            imprisonment=imprisonment,
-            fine_amount=fine_str,
-            source_span=source_span,
-        )
-
-        if subject:
-            role_id = subject.lower()
-            tx.run(
-                """
-                MERGE (r:Role {id: $role_id})
-                ON CREATE SET r.name = $subject
-                MERGE (p:Penalty {id: $pen_id})-[:APPLIES_TO]->(r)
-                """,
-                role_id=role_id,
-                subject=subject,
-                pen_id=pen_id,
-            )
+
+def semantic_rows(secs: list[dict]):
+    """
+    Flatten DefinedTerm / Role / Obligation / Penalty entries of a batch of
+    sections into parameter rows for the MERGE_*_Q queries.
+    """
+    terms, roles, obligations, penalties = [], [], [], []
+
+    for sec in secs:
+        act_id = sec["act_id"]
+        section_id = sec["section_id"]
+
+        # 1) Defined terms
+        for term in sec.get("defined_terms") or []:
+            name = (term.get("term") or "").strip()
+            if not name:
+                continue
+            terms.append({
+                "section_id": section_id,
+                "term_id": f"{act_id}|{name.lower()}",
+                "name": name,
+                "act_id": act_id,
+            })
+
+        # 2) Roles
+        for role_name in sec.get("roles") or []:
+            if not isinstance(role_name, str):
+                continue
+            clean = role_name.strip()
+            if not clean:
+                continue
+            roles.append({
+                "section_id": section_id,
+                "role_id": clean.lower(),
+                "role_name": clean,
+            })
+
+        # 3) Obligations
+        for idx, ob in enumerate(sec.get("obligations") or []):
+            if not isinstance(ob, dict):
+                continue
+            actor = (ob.get("actor") or "").strip()
+            obligations.append({
+                "section_id": section_id,
+                "obl_id": f"{section_id}|ob|{idx}",
+                "action": ob.get("action"),
+                "conditions": ob.get("conditions"),
+                "source_span": ob.get("source_span"),
+                "actor": actor,
+                "actor_id": actor.lower() if actor else None,
+            })
+
+        # 4) Penalties
+        for idx, pen in enumerate(sec.get("penalties") or []):
+            if not isinstance(pen, dict):
+                continue
+            subject = (pen.get("subject") or "").strip()
+            fine_amount = pen.get("fine_amount")
+            penalties.append({
+                "section_id": section_id,
+                "pen_id": f"{section_id}|pen|{idx}",
+                "description": pen.get("description"),
+                "imprisonment": pen.get("imprisonment"),
+                "fine_amount": None if fine_amount is None else str(fine_amount),
+                "source_span": pen.get("source_span"),
+                "subject": subject,
+                "subject_id": subject.lower() if subject else None,
+            })
+
+    return terms, roles, obligations, penalties
 
 
 # ---------- choose kg_ready vs enriched ----------
@@ -225,23 +263,46 @@ def choose_source_file(year: int, act_id: str) -> Path | None:
 
 
 def process_act_file(session, year: int, act_id: str, file_path: Path):
+    """Stream one act's JSONL into Neo4j, SECTION_BATCH_SIZE sections per transaction."""
     count = 0
-    with file_path.open(encoding="utf-8") as f:
+    buf = []
+    with file_path.open("rb") as f:
         for line in f:
             if not line.strip():
                 continue
-            sec = json.loads(line)
-            session.execute_write(merge_section_tx, sec)
-            count += 1
+            buf.append(orjson.loads(line))
+            if len(buf) >= SECTION_BATCH_SIZE:
+                session.execute_write(merge_sections_tx, buf)
+                count += len(buf)
+                buf = []
+    if buf:
+        session.execute_write(merge_sections_tx, buf)
+        count += len(buf)
     print(f"{act_id}: ingested {count} sections from {file_path}")
 
 
+def ingest_act(driver, year: int, act_id: str, file_path: Path):
+    # sessions are not thread-safe: one per act (connections come from the pool)
+    with driver.session() as session:
+        process_act_file(session, year, act_id, file_path)
+
+
 def main():
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    driver = GraphDatabase.driver(
+        NEO4J_URI,
+        auth=(NEO4J_USER, NEO4J_PASSWORD),
+        max_connection_pool_size=50,
+    )
+
+    with driver.session() as session:
+        schema_ok = ensure_schema(session)
 
-    with driver, driver.session() as session, MANIFEST_PATH.open(
-        newline="", encoding="utf-8"
-    ) as f:
+    workers = INGEST_WORKERS if schema_ok else 1
+    if workers != INGEST_WORKERS:
+        print("ingesting acts one at a time (missing uniqueness constraints)")
+
+    jobs = []
+    with MANIFEST_PATH.open(newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         for row in reader:
             year = int(row["year"])
@@ -252,7 +313,12 @@ def main():
                 print(f"{act_id}: no non-empty kg_ready or enriched file, skipping")
                 continue
 
-            process_act_file(session, year, act_id, src)
+            jobs.append((year, act_id, src))
+
+    with driver, ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(ingest_act, driver, *job) for job in jobs]
+        for fut in futures:
+            fut.result()  # re-raise worker errors
 
 
 if __name__ == "__main__":
@@ -13,11 +13,12 @@ Run AFTER 05_stream_to_neo4j.py has populated the base graph.
 """
 
 import csv
-import json
 import os
 from pathlib import Path
 
+import orjson
 from neo4j import GraphDatabase
+from neo4j.exceptions import ClientError
 
 from config import MANIFEST_PATH, ENRICHED_DIR, KG_READY_DIR
 
@@ -147,65 +148,70 @@ def iter_citations_from_section(sec: dict):
 
 # ---------- Neo4j write helpers for CITES ----------
 
-def merge_cites_by_id_tx(tx, source_section_id: str, target_section_id: str):
+def merge_cites_by_id_tx(tx, rows: list[dict]):
     tx.run(
         """
-        MATCH (s1:Section {id: $source_id})
-        MATCH (s2:Section {id: $target_id})
+        UNWIND $rows AS row
+        MATCH (s1:Section {id: row.source_id})
+        MATCH (s2:Section {id: row.target_id})
         MERGE (s1)-[:CITES]->(s2)
         """,
-        source_id=source_section_id,
-        target_id=target_section_id,
+        rows=rows,
     )
 
 
-def merge_cites_by_act_and_no_tx(
-    tx, source_section_id: str, target_act_id: str, target_section_no: str
-):
+def merge_cites_by_act_and_no_tx(tx, rows: list[dict]):
     tx.run(
         """
-        MATCH (s1:Section {id: $source_id})
-        MATCH (a2:Act {id: $target_act_id})-[:HAS_SECTION]->(s2:Section)
-        WHERE s2.sectionNo = $target_section_no
+        UNWIND $rows AS row
+        MATCH (s1:Section {id: row.source_id})
+        MATCH (a2:Act {id: row.target_act_id})-[:HAS_SECTION]->(s2:Section)
+        WHERE s2.sectionNo = row.target_section_no
         MERGE (s1)-[:CITES]->(s2)
         """,
-        source_id=source_section_id,
-        target_act_id=target_act_id,
-        target_section_no=target_section_no,
+        rows=rows,
     )
 
 
 def process_act_citations(session, year: int, act_id: str, file_path: Path):
     total_cites = 0
-    resolved_by_id = 0
-    resolved_by_act = 0
+    # sets: the same citation often repeats within an act, and each duplicate
+    # would be another MATCH + MERGE on the server
+    by_id = set()
+    by_act = set()
 
-    with file_path.open(encoding="utf-8") as f:
+    with file_path.open("rb") as f:
         for line in f:
             if not line.strip():
                 continue
-            sec = json.loads(line)
+            sec = orjson.loads(line)
             for cit in iter_citations_from_section(sec):
                 total_cites += 1
                 if "target_section_id" in cit:
-                    session.execute_write(
-                        merge_cites_by_id_tx,
-                        cit["source_section_id"],
-                        cit["target_section_id"],
-                    )
-                    resolved_by_id += 1
+                    by_id.add((cit["source_section_id"], cit["target_section_id"]))
                 elif "target_act_id" in cit and "target_section_no" in cit:
-                    session.execute_write(
-                        merge_cites_by_act_and_no_tx,
-                        cit["source_section_id"],
-                        cit["target_act_id"],
-                        cit["target_section_no"],
+                    by_act.add(
+                        (cit["source_section_id"], cit["target_act_id"], cit["target_section_no"])
                     )
-                    resolved_by_act += 1
+
+    # one UNWIND per kind for the whole act
+    if by_id:
+        session.execute_write(
+            merge_cites_by_id_tx,
+            [{"source_id": s, "target_id": t} for s, t in by_id],
+        )
+    if by_act:
+        session.execute_write(
+            merge_cites_by_act_and_no_tx,
+            [
+                {"source_id": s, "target_act_id": a, "target_section_no": n}
+                for s, a, n in by_act
+            ],
+        )
 
     print(
         f"{act_id}: citations processed={total_cites}, "
-        f"resolved_by_id={resolved_by_id}, resolved_by_act+secNo={resolved_by_act}"
+        f"resolved_by_id={len(by_id)}, resolved_by_act+secNo={len(by_act)}"
     )
 
 
@@ -227,63 +233,117 @@ def add_cites_edges(session):
             process_act_citations(session, year, act_id, src)
 
 
+# ---------- batched whole-graph writes ----------
+
+def run_periodic(session, outer: str, inner: str, batch_size: int, parallel: bool = False):
+    """
+    Run `inner` once per row of `outer` in APOC-managed batches, so a pass over
+    the whole graph is many small transactions instead of one that has to hold
+    every change (and lock) in memory until commit.
+
+    Only set `parallel` when batches can't touch the same nodes/relationships.
+    Falls back to one `CALL { outer } inner` transaction if APOC isn't installed.
+    """
+    try:
+        rec = session.run(
+            """
+            CALL apoc.periodic.iterate($outer, $inner,
+                 {batchSize: $batch_size, parallel: $parallel})
+            YIELD batches, total, failedBatches, errorMessages
+            RETURN batches, total, failedBatches, errorMessages
+            """,
+            outer=outer,
+            inner=inner,
+            batch_size=batch_size,
+            parallel=parallel,
+        ).single()
+    except ClientError as e:
+        if e.code != "Neo.ClientError.Procedure.ProcedureNotFound":
+            raise
+        print("  apoc.periodic.iterate not available, running as a single transaction")
+        session.run(f"CALL {{ {outer} }} {inner}").consume()
+        return
+
+    print(f"  {rec['total']} rows in {rec['batches']} batches")
+    if rec["failedBatches"]:
+        print(f"  {rec['failedBatches']} batches failed:", rec["errorMessages"])
+
+
 def add_same_term_as(session):
     print("=== Step 2: Linking DefinedTerm nodes with SAME_TERM_AS ===")
-    cypher = """
+    # one row per group of same-named terms; groups share no nodes -> parallel
+    outer = """
     MATCH (t:DefinedTerm)
     WITH toLower(t.name) AS key, collect(t) AS terms
     WHERE size(terms) > 1
+    RETURN terms
+    """
+    inner = """
     UNWIND terms AS t1
     UNWIND terms AS t2
-    WITH key, t1, t2 WHERE id(t1) < id(t2)
+    WITH t1, t2 WHERE id(t1) < id(t2)
     MERGE (t1)-[:SAME_TERM_AS]->(t2)
     """
-    session.run(cypher)
+    run_periodic(session, outer, inner, batch_size=1000, parallel=True)
     print("SAME_TERM_AS relationships created (or updated).")
 
 
 def add_appears_in_act(session):
     print("=== Step 3: Linking Role -> Act via APPEARS_IN_ACT ===")
-    cypher = """
-    MATCH (a:Act)-[:HAS_SECTION]->(s:Section)-[:MENTIONS_ROLE]->(r:Role)
+    # a role shows up in many acts, so batches would contend on it: serial
+    outer = """
+    MATCH (a:Act)-[:HAS_SECTION]->(:Section)-[:MENTIONS_ROLE]->(r:Role)
+    RETURN DISTINCT r, a
+    """
+    inner = """
     MERGE (r)-[:APPEARS_IN_ACT]->(a)
     """
-    session.run(cypher)
+    run_periodic(session, outer, inner, batch_size=10000)
     print("APPEARS_IN_ACT relationships created (or updated).")
 
 
 def add_role_cooccurrence(session):
     print("=== Step 4: Building role CO_OCCURS_WITH network ===")
-    cypher = """
+    # roles sorted by id, then only the upper triangle (i < j): k(k-1)/2 pairs
+    # per section instead of k^2 filtered down. Pair counts are aggregated over
+    # all sections first, so each edge is MERGEd/locked once, not once per section.
+    # Pairs share roles across batches -> serial.
+    outer = """
     MATCH (s:Section)-[:MENTIONS_ROLE]->(r:Role)
+    WITH s, r ORDER BY id(r)
     WITH s, collect(DISTINCT r) AS roles
-    UNWIND roles AS r1
-    UNWIND roles AS r2
-    WITH r1, r2
-    WHERE id(r1) < id(r2)
+    WHERE size(roles) > 1
+    UNWIND range(0, size(roles) - 2) AS i
+    UNWIND range(i + 1, size(roles) - 1) AS j
+    RETURN roles[i] AS r1, roles[j] AS r2, count(*) AS n
+    """
+    inner = """
     MERGE (r1)-[c:CO_OCCURS_WITH]->(r2)
-    ON CREATE SET c.count = 1
-    ON MATCH  SET c.count = c.count + 1
+    ON CREATE SET c.count = n
+    ON MATCH  SET c.count = c.count + n
     """
-    session.run(cypher)
+    run_periodic(session, outer, inner, batch_size=10000)
     print("CO_OCCURS_WITH relationships created/updated with counts.")
 
 
 def add_severity_scores(session):
     print("=== Step 5: Computing severity_score for sections ===")
-    cypher = """
-    MATCH (s:Section)-[:PRESCRIBES_PENALTY]->(p:Penalty)
-    WITH s, collect(p) AS pens
-    UNWIND pens AS p
-    WITH s, pens,
+    # each row only writes its own section -> parallel
+    outer = """
+    MATCH (s:Section)
+    WHERE (s)-[:PRESCRIBES_PENALTY]->(:Penalty)
+    RETURN s
+    """
+    inner = """
+    MATCH (s)-[:PRESCRIBES_PENALTY]->(p:Penalty)
+    WITH s, count(p) AS numPens,
          sum(
            CASE WHEN p.imprisonment IS NOT NULL AND p.imprisonment <> "" THEN 2 ELSE 0 END +
            CASE WHEN p.fine_amount IS NOT NULL AND p.fine_amount <> "" THEN 1 ELSE 0 END
          ) AS baseScore
-    WITH s, baseScore, size(pens) AS numPens
     SET s.severity_score = baseScore + numPens
     """
-    session.run(cypher)
+    run_periodic(session, outer, inner, batch_size=10000, parallel=True)
     print("severity_score set on sections with penalties.")
 
 
@@ -2,20 +2,34 @@
 
 import re
 import csv
-import json
+import fnmatch
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import pdfplumber  # pip install pdfplumber
+import orjson
+import pypdfium2 as pdfium  # pip install pypdfium2
 
-from config import MANIFEST_PATH, ENRICHED_DIR, ACTS_ROOT
+from config import MANIFEST_PATH, ENRICHED_DIR, ACTS_ROOT, WRITE_BUFFER_SIZE
 
 NEW_ENRICHED_DIR = Path("data/new_enriched")
 NEW_ENRICHED_DIR.mkdir(parents=True, exist_ok=True)
 
+# "<... Act|Ordinance|Code ...> <year>" -- searched, so no leading .* to backtrack over
 TITLE_REGEX = re.compile(
-    r".*\b(Act|Ordinance|Code)\b.*\b(18|19|20)\d{2}\b",
+    r"\b(?:Act|Ordinance|Code)\b.*\b(?:18|19|20)\d{2}\b",
     re.IGNORECASE,
 )
+# cheap substring reject before the regex; lowercase because the regex is IGNORECASE
+_TOKENS = ("act", "ordinance", "code")
+
+
+def is_title_line(ln: str) -> bool:
+    low = ln.lower()
+    if not any(t in low for t in _TOKENS):
+        return False
+    return TITLE_REGEX.search(ln) is not None
 
 
 def extract_title(pdf_path: Path) -> str | None:
@@ -24,52 +38,72 @@ def extract_title(pdf_path: Path) -> str | None:
         print("PDF not found:", pdf_path)
         return None
 
+    # pdfium hands back the raw text layer; pdfplumber's layout reconstruction
+    # was most of this script's runtime and the title is almost always on page 1
+    pdf = None
     try:
-        with pdfplumber.open(str(pdf_path)) as pdf:
-            num_pages = len(pdf.pages)
-            pages_to_read = min(2, num_pages)
-
-            for i in range(pages_to_read):
-                page = pdf.pages[i]
-                text = page.extract_text() or ""
-                lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-
-                for ln in lines[:10]:
-                    if TITLE_REGEX.match(ln):
-                        return ln
+        pdf = pdfium.PdfDocument(str(pdf_path))
+        for i in range(min(2, len(pdf))):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+
+            lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+            for ln in lines[:10]:
+                if is_title_line(ln):
+                    return ln
     except Exception as e:
         print("Error extracting title from", pdf_path, "->", type(e).__name__, e)
+    finally:
+        if pdf is not None:
+            pdf.close()
 
     return None
 
 
+@functools.lru_cache(maxsize=None)
+def _year_index(year: int) -> dict[str, os.DirEntry]:
+    """name -> DirEntry for one enriched year folder, read once per process."""
+    try:
+        with os.scandir(ENRICHED_DIR / str(year)) as it:
+            return {e.name: e for e in it}
+    except FileNotFoundError:
+        return {}
+
+
 def find_enriched_file(year: int, act_id: str) -> Path | None:
     """
     Old enriched files are named like:
         data/enriched/<year>/<year>_<seq>_enriched.jsonl
     where act_id = "<year>_<seq>".
     """
-    year_dir = ENRICHED_DIR / str(year)
-    if not year_dir.exists():
+    # one scandir per year instead of exists/stat/glob per act
+    idx = _year_index(year)
+    if not idx:
         return None
 
     parts = act_id.split("_", 1)
     seq = parts[1] if len(parts) > 1 else act_id
 
     # main pattern: year_seq_enriched.jsonl
-    candidate = year_dir / f"{year}_{seq}_enriched.jsonl"
-    if candidate.exists() and candidate.stat().st_size > 0:
-        return candidate
+    ent = idx.get(f"{year}_{seq}_enriched.jsonl")
+    if ent is not None and ent.stat().st_size > 0:
+        return Path(ent.path)
 
     # fallback: anything containing "_<seq>_enriched"
-    for cand in year_dir.glob(f"*_{seq}_enriched*.json*"):
-        if cand.stat().st_size > 0:
-            return cand
+    pattern = f"*_{seq}_enriched*.json*"
+    for name, ent in idx.items():
+        if fnmatch.fnmatch(name, pattern) and ent.stat().st_size > 0:
+            return Path(ent.path)
 
     return None
 
 
-def process_act(year: int, act_id: str):
+def process_act(year: int, act_id: str) -> str:
     # PDF path: acts_pdf/<year>/<seq>.pdf
     parts = act_id.split("_", 1)
     seq = parts[1] if len(parts) > 1 else act_id
@@ -77,8 +111,7 @@ def process_act(year: int, act_id: str):
 
     old_enriched = find_enriched_file(year, act_id)
     if old_enriched is None:
-        print(f"Skipping {act_id}: could not find non-empty enriched file in {ENRICHED_DIR/str(year)}")
-        return
+        return f"Skipping {act_id}: could not find non-empty enriched file in {ENRICHED_DIR/str(year)}"
 
     new_dir = NEW_ENRICHED_DIR / str(year)
     new_dir.mkdir(parents=True, exist_ok=True)
@@ -86,29 +119,46 @@ def process_act(year: int, act_id: str):
 
     title = extract_title(pdf_path) or ""
 
-    with old_enriched.open(encoding="utf-8") as f_in, \
-         new_file.open("w", encoding="utf-8") as f_out:
+    # the title is the same for every section, so splice it in as text:
+    # `{...}` -> `{...,"act_title":"..."}` without a parse/dump per line
+    suffix = b',"act_title":' + orjson.dumps(title) + b"}\n"
+
+    with old_enriched.open("rb") as f_in, \
+         new_file.open("wb", buffering=WRITE_BUFFER_SIZE) as f_out:
 
         for line in f_in:
             line = line.strip()
             if not line:
                 continue
 
-        # add act_title to each section
-            section = json.loads(line)
+            if line.endswith(b"}") and line != b"{}" and b'"act_title"' not in line:
+                f_out.write(line[:-1])
+                f_out.write(suffix)
+                continue
+
+            # odd line (empty object, already titled, not an object): parse it
+            section = orjson.loads(line)
             section["act_title"] = title
-            f_out.write(json.dumps(section, ensure_ascii=False) + "\n")
+            f_out.write(orjson.dumps(section))
+            f_out.write(b"\n")
+
+    return f"{act_id}: used {old_enriched.name}, wrote new_enriched with title -> {title}"
 
-    print(f"{act_id}: used {old_enriched.name}, wrote new_enriched with title -> {title}")
+
+def process_row(row: dict) -> str:
+    """Worker entry point: one manifest row -> status line."""
+    return process_act(int(row["year"]), row["act_id"])
 
 
 def main():
     with MANIFEST_PATH.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            year = int(row["year"])
-            act_id = row["act_id"]
-            process_act(year, act_id)
+        rows = list(csv.DictReader(f))
+
+    # title extraction is PDF-bound and acts are independent ->
+    # one process per core, same layout as stages 01-03
+    with ProcessPoolExecutor() as ex:
+        for msg in ex.map(process_row, rows, chunksize=16):
+            print(msg)
 
 
 if __name__ == "__main__":
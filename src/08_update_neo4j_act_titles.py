@@ -1,63 +1,145 @@
 # src/08_update_neo4j_act_titles.py
 
-from neo4j import GraphDatabase
-import json
+import asyncio
+import mmap
+import orjson
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from config import get_async_driver
+
 NEW_ENRICHED_DIR = Path("data/new_enriched")
 
-NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "ds246@IISc")
+# acts per write transaction
+TITLE_BATCH_SIZE = 1000
 
+# write transactions in flight at once (each on its own pooled connection)
+MAX_CONCURRENT_WRITES = 16
 
-def main():
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+SET_TITLES_Q = """
+UNWIND $rows AS row
+MATCH (a:Act {id: row.act_id})
+SET a.title = row.title,
+    a.title_lower = toLower(row.title)
+"""
+
+
+async def ensure_act_index(session):
+    from neo4j.exceptions import ClientError
+
+    # 05 normally created a unique constraint on :Act(id) already, which comes
+    # with an index; this only matters for graphs built without it
+    try:
+        result = await session.run("CREATE INDEX act_id_index IF NOT EXISTS FOR (a:Act) ON (a.id)")
+        await result.consume()
+    except ClientError as e:
+        print("could not create index on :Act(id):", e.message)
+
+
+async def set_titles_tx(tx, rows):
+    result = await tx.run(SET_TITLES_Q, rows=rows)
+    await result.consume()
+
+
+async def write_titles(rows):
+    """UNWIND the rows in TITLE_BATCH_SIZE chunks, several chunks in flight at once."""
+    driver = get_async_driver()
+    sem = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
+
+    async def write_chunk(chunk):
+        async with sem, driver.session() as session:
+            await session.execute_write(set_titles_tx, chunk)
+
+    async with driver:
+        async with driver.session() as session:
+            await ensure_act_index(session)
+        # rows are unique per act, so chunks don't wait on each other's locks
+        await asyncio.gather(*(
+            write_chunk(rows[i : i + TITLE_BATCH_SIZE])
+            for i in range(0, len(rows), TITLE_BATCH_SIZE)
+        ))
+
+
+# Sections are written by 02 with act_id as the first key, and 07 splices
+# act_title in as the last one, so both sit at fixed ends of the line. Plain
+# (escape-free) strings only; anything else goes through orjson.
+_ACT_ID_RE = re.compile(rb'\{\s*"act_id"\s*:\s*"([^"\\]*)"')
+_ACT_TITLE_RE = re.compile(rb'"act_title"\s*:\s*"([^"\\]*)"\s*\}\s*$')
 
+
+def parse_act_fields(line: bytes):
+    """(act_id, raw title) from one section line without building the dict."""
+    m_id = _ACT_ID_RE.match(line.lstrip())
+    pos = line.rfind(b'"act_title"')
+    m_title = _ACT_TITLE_RE.match(line, pos) if pos != -1 else None
+    if m_id and m_title:
+        return m_id.group(1).decode("utf-8"), m_title.group(1).decode("utf-8")
+
+    sec = orjson.loads(line)
+    return sec.get("act_id"), sec.get("act_title")
+
+
+def extract_first_record(file: Path):
+    """(act_id, title) from the first section line of one act file, or None."""
+    # We only need the first non-empty line for that act. mmap + find: only
+    # the pages up to the first newline are ever read, however big the file.
+    with file.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None  # can't mmap an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while True:
+                nl = mm.find(b"\n", start)
+                line = mm[start:] if nl == -1 else mm[start:nl]
+                if line.strip() or nl == -1:
+                    break
+                start = nl + 1
+    if not line.strip():
+        return None
+
+    act_id, title = parse_act_fields(line)
+    title = (title or "").strip()
+    if not act_id or not title:
+        return None
+    return act_id, title
+
+
+def main():
     if not NEW_ENRICHED_DIR.exists():
         print("new_enriched directory not found:", NEW_ENRICHED_DIR)
         return
 
-    with driver.session() as session:
-        # iterate year folders
-        for year_dir in sorted(NEW_ENRICHED_DIR.iterdir()):
-            if not year_dir.is_dir():
-                continue
-
-            for file in sorted(year_dir.glob("*_enriched.jsonl")):
-                print("Processing", file)
-
-                act_id = None
-                title = None
-
-                # We only need the first non-empty line for that act
-                with file.open(encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        sec = json.loads(line)
-                        act_id = sec.get("act_id")
-                        title = (sec.get("act_title") or "").strip()
-                        break  # first section line is enough
-
-                if not act_id or not title:
-                    print("  -> missing act_id or title, skipped")
-                    continue
-
-                session.run(
-                    """
-                    MATCH (a:Act {id: $act_id})
-                    SET a.title = $title
-                    """,
-                    act_id=act_id,
-                    title=title,
-                )
-                print(f"  -> Updated Act {act_id} with title: {title}")
-
-    driver.close()
-    print("Done updating Act titles in Neo4j.")
+    # iterate year folders; os.scandir hands back names + file types from the
+    # directory read itself, no stat per entry
+    files = []
+    with os.scandir(NEW_ENRICHED_DIR) as it:
+        year_dirs = sorted((e for e in it if e.is_dir()), key=lambda e: e.name)
+    for year_dir in year_dirs:
+        with os.scandir(year_dir.path) as it:
+            names = sorted(e.name for e in it if e.name.endswith("_enriched.jsonl"))
+        files.extend(Path(year_dir.path, name) for name in names)
+
+    # thousands of tiny reads: overlap them on threads (I/O bound, GIL released)
+    with ThreadPoolExecutor(max_workers=32) as ex:
+        results = list(ex.map(extract_first_record, files))
+
+    # one write per act: several files can carry the same act_id (first wins),
+    # and duplicates in concurrent chunks would also contend on the same node
+    titles: dict[str, str] = {}
+    for file, res in zip(files, results):
+        if res is None:
+            print(f"{file}: missing act_id or title, skipped")
+            continue
+        act_id, title = res
+        titles.setdefault(act_id, title)
+
+    rows = [{"act_id": act_id, "title": title} for act_id, title in titles.items()]
+
+    # one UNWIND per TITLE_BATCH_SIZE acts instead of a round trip per act
+    asyncio.run(write_titles(rows))
+    print(f"Done updating {len(rows)} Act titles in Neo4j.")
 
 
 if __name__ == "__main__":
@@ -1,26 +1,57 @@
 # src/09_add_section_to_act_edges.py
 
-from neo4j import GraphDatabase
-import os
-
-NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "ds246@IISc")
-
-
-def main():
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-
-    cypher = """
-    MATCH (a:Act)-[:HAS_SECTION]->(s:Section)
+from neo4j.exceptions import ClientError
+
+from config import get_driver
+
+
+# Missing edges only, so CREATE is enough (05 MERGEs HAS_SECTION, one per
+# Act/Section pair) and reruns are no-ops. APOC commits the batches on a
+# worker pool; sections of the same act can land in concurrent batches and
+# contend on the Act node, hence the retries.
+APOC_CYPHER = """
+CALL apoc.periodic.iterate(
+    'MATCH (a:Act)-[:HAS_SECTION]->(s:Section)
+     WHERE NOT (s)-[:OF_ACT]->(a)
+     RETURN a, s',
+    'CREATE (s)-[:OF_ACT]->(a)',
+    {batchSize: 5000, parallel: true, concurrency: 8, retries: 3}
+)
+YIELD total, failedBatches, errorMessages, updateStatistics
+RETURN total, failedBatches, errorMessages,
+       updateStatistics.relationshipsCreated AS created
+"""
+
+# without APOC: committed every 10k rows instead of one transaction holding
+# every new edge until the end; needs an auto-commit query, i.e. session.run
+FALLBACK_CYPHER = """
+MATCH (a:Act)-[:HAS_SECTION]->(s:Section)
+CALL {
+    WITH a, s
     MERGE (s)-[:OF_ACT]->(a)
-    """
+} IN TRANSACTIONS OF 10000 ROWS
+"""
 
-    with driver.session() as session:
-        session.run(cypher)
-        print("Created OF_ACT relationships from Section -> Act.")
 
-    driver.close()
+def main():
+    driver = get_driver()
+
+    with driver.session(database="neo4j") as session:
+        try:
+            rec = session.run(APOC_CYPHER).single()
+        except ClientError as e:
+            if e.code != "Neo.ClientError.Procedure.ProcedureNotFound":
+                raise
+            print("apoc.periodic.iterate not available, using CALL IN TRANSACTIONS")
+            summary = session.run(FALLBACK_CYPHER).consume()
+            created = summary.counters.relationships_created
+        else:
+            # `total` counts rows processed, failed batches included
+            created = rec["created"]
+            if rec["failedBatches"]:
+                print(f"{rec['failedBatches']} batches failed:", rec["errorMessages"])
+
+        print(f"Created {created} OF_ACT relationships from Section -> Act.")
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
 # config.py
+import atexit
+import functools
+import os
 from pathlib import Path
 
 # Adjust this to your actual path
@@ -11,5 +14,53 @@ ENRICHED_DIR = Path("C:/Users/vaibh/Desktop/New folder/data/enriched")
 KG_READY_DIR = Path("C:/Users/vaibh/Desktop/New folder/data/kg_ready")
 MANIFEST_PATH = Path("C:/Users/vaibh/Desktop/New folder/data/acts_manifest.csv")
 
+# sqlite LLM result cache shared by the enrichment stages (see llm_cache.py)
+LLM_CACHE_PATH = KG_READY_DIR / ".llm_cache.sqlite"
+
+# Stage 02: also emit per-line provenance ({page, line_index, text}) for each
+# section. Off by default - it duplicates `text` and dominates the file size.
+KEEP_RAW_LINES = False
+
+# Buffer size for the binary JSONL writers (04, 07). Sections are small, so the
+# default 8 KiB buffer means a write() syscall every few records.
+WRITE_BUFFER_SIZE = 1 << 20
+
 for p in [DATA_ROOT, LINES_DIR, SECTIONS_DIR, ENRICHED_DIR, KG_READY_DIR]:
     p.mkdir(parents=True, exist_ok=True)
+
+
+# ---------- Neo4j ----------
+# One driver (= one connection pool) per process, shared by the graph stages.
+# Created on first use so the PDF/LLM stages don't need neo4j installed.
+
+NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "ds246@IISc")  # change or set env vars
+
+NEO4J_POOL_SETTINGS = {
+    "max_connection_pool_size": 64,       # room for the threaded/async writers
+    "connection_acquisition_timeout": 60,  # seconds to wait for a free connection
+    "max_connection_lifetime": 3600,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_driver():
+    # one shared driver, owned by the process: callers must not close it
+    # (a closed driver would stay in the cache); it is closed at exit
+    from neo4j import GraphDatabase
+
+    driver = GraphDatabase.driver(
+        NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), **NEO4J_POOL_SETTINGS
+    )
+    atexit.register(driver.close)
+    return driver
+
+
+def get_async_driver():
+    # not cached: an async driver belongs to the event loop it is used on
+    from neo4j import AsyncGraphDatabase
+
+    return AsyncGraphDatabase.driver(
+        NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), **NEO4J_POOL_SETTINGS
+    )
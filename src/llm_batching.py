@@ -0,0 +1,135 @@
+# llm_batching.py
+# Provider-independent half of the txt.py (Gemini) / txt2.py (Groq) batch
+# extractors: SECTIONS block building, size-capped packing, reply parsing and
+# the cached, concurrent batch runner. Each provider file keeps only its client
+# and the call itself.
+import asyncio
+
+import orjson
+
+from llm_cache import llm_cache_get, llm_cache_key, llm_cache_put
+
+# upper bound on the SECTIONS block per call; longer prompts get slower per
+# section, so big acts are split over more (concurrent) calls instead
+MAX_PROMPT_CHARS = 12000
+
+
+def section_parts(entry):
+    """Text fragments of one section: "SECTION <idx>:\n1. ...\n2. ..."."""
+    yield f"SECTION {entry['section_index']}:\n"
+    for i, s in enumerate(entry["sentences"]):
+        yield f"{i+1}. {s}" if i == 0 else f"\n{i+1}. {s}"
+
+
+def build_sections_block(batch_inputs):
+    # every fragment into one list, one join at the end
+    parts = []
+    for k, entry in enumerate(batch_inputs):
+        if k:
+            parts.append("\n\n")
+        parts.extend(section_parts(entry))
+    return "".join(parts)
+
+
+def pack_batches(entries, max_chars=MAX_PROMPT_CHARS):
+    """Greedily group entries so each batch's SECTIONS block stays under max_chars."""
+    batch, size = [], 0
+    for entry in entries:
+        n = sum(map(len, section_parts(entry))) + 2  # + the "\n\n" separator
+        if batch and size + n > max_chars:
+            yield batch
+            batch, size = [], 0
+        batch.append(entry)
+        size += n
+    if batch:
+        yield batch
+
+
+# the semantic fields every per-section result carries
+_KEYS = ("roles", "obligations", "powers", "penalties", "rights")
+
+
+def parse_llm_output(text):
+    """Model reply -> dict mapping section_index -> result dict ({} if unusable)."""
+    # Fail-safe: empty or None output → skip
+    if not text or not isinstance(text, str):
+        return {}
+
+    # a reply cut off mid-JSON (length limit, timeout) can't end in } or ];
+    # skip it without paying for a parse that is bound to fail
+    text = text.strip()
+    if not text or text[-1] not in "}]":
+        print("LLM output truncated or not JSON, skipping batch")
+        return {}
+
+    # Parse JSON safely
+    try:
+        parsed = orjson.loads(text)
+    except Exception as e:
+        print("LLM JSON parse error:", type(e).__name__, e)
+        return {}
+
+    # expected: list of objects, each with section_index + semantic data
+    if not isinstance(parsed, list):
+        parsed = [parsed]
+
+    out = {}
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        idx = item.get("section_index")
+        if idx is None:
+            continue
+
+        out[idx] = {k: item.get(k) or [] for k in _KEYS}
+
+    return out
+
+
+async def run_llm_batches(entries, acall_llm_batch, max_concurrency, cache=None, salt=None):
+    """
+    Pack entries with pack_batches and run the batches concurrently through
+    `acall_llm_batch(batch, sem)` (up to max_concurrency in flight). Returns
+    merged section_index -> result.
+
+    With `cache` (llm_cache.open_llm_cache()) and the provider's `salt`, cached
+    sections and in-call duplicates never reach the LLM, and every answered
+    section is stored.
+    """
+    out = {}
+    todo = []
+    pending = {}  # cache key -> section indexes waiting on that LLM result
+    for entry in entries:
+        if cache is None:
+            todo.append(entry)
+            continue
+        idx = entry["section_index"]
+        key = llm_cache_key(salt, entry["sentences"])
+        hit = llm_cache_get(cache, key)
+        if hit is not None:
+            out[idx] = hit
+        elif key in pending:
+            pending[key].append(idx)
+        else:
+            pending[key] = [idx]
+            todo.append(entry)
+
+    sem = asyncio.Semaphore(max_concurrency)
+    results = {}
+    batches = pack_batches(todo)
+    for res in await asyncio.gather(*(acall_llm_batch(b, sem) for b in batches)):
+        results.update(res)
+    out.update(results)
+
+    # only store what the LLM actually answered; failed batches retry next run
+    for key, idxs in pending.items():
+        res = results.get(idxs[0])
+        if res is None:
+            continue
+        for idx in idxs[1:]:
+            out[idx] = res
+        llm_cache_put(cache, key, res)
+    if cache is not None:
+        cache.commit()
+
+    return out
@@ -0,0 +1,46 @@
+# llm_cache.py
+# Exact-match LLM result cache shared by the enrichment stages (04, txt.py,
+# txt2.py): same candidate sentences (same model + prompt) -> same extraction.
+# The boilerplate "shall be punished with ..." sections repeat across acts, and
+# reruns after a crash replay everything already paid for. One sqlite file for
+# all of them; keys are salted per model/prompt, so entries never collide.
+import hashlib
+import sqlite3
+
+import orjson
+
+from config import LLM_CACHE_PATH
+
+
+def cache_salt(*parts):
+    # model/prompt changes must not serve stale results
+    return hashlib.blake2b("\0".join(parts).encode("utf-8"), digest_size=16).digest()
+
+
+def open_llm_cache(path=LLM_CACHE_PATH):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, result BLOB NOT NULL)"
+    )
+    return conn
+
+
+def llm_cache_key(salt, sentences):
+    h = hashlib.blake2b(salt, digest_size=16)
+    for s in sentences:
+        h.update(s.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def llm_cache_get(conn, key):
+    row = conn.execute("SELECT result FROM llm_cache WHERE key = ?", (key,)).fetchone()
+    return orjson.loads(row[0]) if row else None
+
+
+def llm_cache_put(conn, key, result):
+    # caller commits (once per act / call, not per row)
+    conn.execute(
+        "INSERT OR REPLACE INTO llm_cache (key, result) VALUES (?, ?)",
+        (key, orjson.dumps(result)),
+    )
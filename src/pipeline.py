@@ -0,0 +1,86 @@
+# src/pipeline.py
+# Fused stages 01 -> 02 -> 03: PDF -> lines -> sections -> rule-enriched,
+# streamed per act with no intermediate JSONL round trips.
+# The stage scripts stay as they are for running/debugging one stage at a time.
+#
+#   python pipeline.py                      # writes ENRICHED_DIR only
+#   python pipeline.py --dump-intermediate  # also writes LINES_DIR / SECTIONS_DIR
+#
+# Stage 04 (LLM) still runs separately: it is network bound, rate limited and
+# skips acts that already have KG-ready output.
+
+import argparse
+import csv
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import orjson
+
+from config import MANIFEST_PATH, LINES_DIR, SECTIONS_DIR, ENRICHED_DIR
+
+# stage modules start with digits, so no plain `import`
+extract_lines = importlib.import_module("01_extract_lines")
+parse_structure = importlib.import_module("02_parse_structure")
+enrich_rule_based = importlib.import_module("03_enrich_rule_based")
+
+
+def tee_jsonl(records: Iterable[dict], path: Path) -> Iterator[dict]:
+    """Pass records through unchanged while also writing them to `path`."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as f:
+        for rec in records:
+            f.write(orjson.dumps(rec))
+            f.write(b"\n")
+            yield rec
+
+
+def process_row(row: dict, dump_intermediate: bool = False) -> str:
+    act_id = row["act_id"]
+    year = int(row["year"])
+    seq = int(row["seq"])
+
+    out_dir = ENRICHED_DIR / str(year)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = out_dir / f"{act_id}_enriched.jsonl"
+
+    lines = extract_lines.iter_lines(act_id, row["file_path"], year, seq)
+    if dump_intermediate:
+        lines = tee_jsonl(lines, LINES_DIR / str(year) / f"{act_id}_lines.jsonl")
+
+    sections = parse_structure.iter_sections(lines, act_id, year, seq)
+    if dump_intermediate:
+        sections = tee_jsonl(sections, SECTIONS_DIR / str(year) / f"{act_id}_sections.jsonl")
+
+    with out_path.open("wb") as f_out:
+        for sec in enrich_rule_based.iter_enriched(sections):
+            f_out.write(orjson.dumps(sec))
+            f_out.write(b"\n")
+
+    return f"{act_id}: enriched -> {out_path}"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Run stages 01-03 as one streaming pass per act.")
+    ap.add_argument(
+        "--dump-intermediate",
+        action="store_true",
+        help="also write the stage 01/02 lines and sections JSONL files",
+    )
+    args = ap.parse_args()
+
+    with MANIFEST_PATH.open(newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+
+    worker = partial(process_row, dump_intermediate=args.dump_intermediate)
+
+    # same layout as the stage scripts: one process per core, acts are independent
+    with ProcessPoolExecutor(initializer=extract_lines._init_worker) as ex:
+        for msg in ex.map(worker, rows, chunksize=4):
+            print(msg)
+
+
+if __name__ == "__main__":
+    main()
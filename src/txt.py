@@ -1,6 +1,33 @@
 #client = Client(api_key=os.getenv("GEMINI_API_KEY"))
 #GEMINI_MODEL = "gemini-2.5-flash"
 
+import functools
+
+from llm_batching import build_sections_block, parse_llm_output, run_llm_batches
+from llm_cache import cache_salt
+
+# Gemini batches in flight at once (keep under the per-key RPM limit)
+MAX_CONCURRENCY = 8
+
+
+# ---------- LLM RESULT CACHE ----------
+# Same candidate sentences (same model + prompt) -> same extraction, so reruns
+# and sections repeated across acts never pay for a second call (llm_cache.py,
+# the same sqlite file the 04 stage uses).
+
+
+@functools.lru_cache(maxsize=None)
+def _cache_salt():
+    # built on first use: PROMPT_TEMPLATE_BATCH is pasted in by hand
+    return cache_salt(GEMINI_MODEL, PROMPT_TEMPLATE_BATCH)
+
+
+def build_prompt(batch_inputs):
+    # Build the sections block
+    sections_block = build_sections_block(batch_inputs)
+    return PROMPT_TEMPLATE_BATCH.format(sections_block=sections_block)
+
+
 def call_llm_batch(batch_inputs):
     """
     batch_inputs: list of dicts:
@@ -11,17 +38,7 @@ def call_llm_batch(batch_inputs):
     if not batch_inputs:
         return {}
 
-    # Build the sections block
-    blocks = []
-    for entry in batch_inputs:
-        idx = entry["section_index"]
-        sent_list = entry["sentences"]
-        numbered = "\n".join(f"{i+1}. {s}" for i, s in enumerate(sent_list))
-        block = f"SECTION {idx}:\n{numbered}"
-        blocks.append(block)
-
-    sections_block = "\n\n".join(blocks)
-    prompt = PROMPT_TEMPLATE_BATCH.format(sections_block=sections_block)
+    prompt = build_prompt(batch_inputs)
 
     try:
         response = client.models.generate_content(
@@ -29,45 +46,39 @@ def call_llm_batch(batch_inputs):
             contents=prompt,
             config={"response_mime_type": "application/json"},
         )
+        return parse_llm_output(response.text)
 
-        text = response.text
-
-        # ---- safe guard against None / invalid ----
-        if not text or not isinstance(text, str):
-            return {}
-
-        try:
-            parsed = json.loads(text)
-        except Exception as e:
-            print("LLM JSON parse error:", type(e).__name__, e)
-            # if JSON can't be parsed, give up for this batch
-            return {}
-
-        # We expect an array of objects
-        if not isinstance(parsed, list):
-            parsed = [parsed]
-
-        out = {}
-        for item in parsed:
-            if not isinstance(item, dict):
-                continue
-            idx = item.get("section_index")
-            if idx is None:
-                continue
-
-            # ensure keys exist
-            res = {
-                "roles": item.get("roles") or [],
-                "obligations": item.get("obligations") or [],
-                "powers": item.get("powers") or [],
-                "penalties": item.get("penalties") or [],
-                "rights": item.get("rights") or [],
-            }
-            out[idx] = res
-
-        return out
+    except Exception as e:
+        print("LLM batch error:", type(e).__name__, e)
+        return {}
+
+
+async def acall_llm_batch(batch_inputs, sem):
+    """Async call_llm_batch via the client's aio surface; `sem` caps calls in flight."""
+    if not batch_inputs:
+        return {}
+
+    prompt = build_prompt(batch_inputs)
+
+    try:
+        async with sem:
+            response = await client.aio.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=prompt,
+                config={"response_mime_type": "application/json"},
+            )
+        return parse_llm_output(response.text)
 
     except Exception as e:
         print("LLM batch error:", type(e).__name__, e)
         return {}
 
+
+async def call_llm_batches(entries, cache=None):
+    """
+    Pack entries into size-capped batches and run them concurrently (up to
+    MAX_CONCURRENCY). Returns merged section_index -> result; see
+    llm_batching.run_llm_batches for the `cache` handling.
+    """
+    salt = _cache_salt() if cache is not None else None
+    return await run_llm_batches(entries, acall_llm_batch, MAX_CONCURRENCY, cache, salt)
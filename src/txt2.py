@@ -1,8 +1,55 @@
-"""from groq import Groq
+import functools
 import os
 
+from groq import AsyncGroq, Groq
+
+from llm_batching import build_sections_block, parse_llm_output, run_llm_batches
+from llm_cache import cache_salt
+
 client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-MODEL = "qwen/qwen3-32b"""
+aclient = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+MODEL = "qwen/qwen3-32b"
+
+# Groq batches in flight at once (keep under the per-key RPM limit)
+MAX_CONCURRENCY = 4
+
+
+# ---------- LLM RESULT CACHE ----------
+# Same candidate sentences (same model + prompt) -> same extraction, so reruns
+# and sections repeated across acts never pay for a second call (llm_cache.py,
+# the same sqlite file the 04 stage uses).
+
+
+@functools.lru_cache(maxsize=None)
+def _cache_salt():
+    # built on first use: PROMPT_TEMPLATE_BATCH is pasted in by hand
+    return cache_salt(MODEL, PROMPT_TEMPLATE_BATCH)
+
+
+_SYS_MSG = {
+    "role": "system",
+    "content": "You are a structured legal information extractor. Respond ONLY using strict JSON.",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _prompt_parts():
+    # PROMPT_TEMPLATE_BATCH split around its only field once, so each call is a
+    # plain concatenation instead of str.format re-parsing the whole template;
+    # the {{ }} escapes are undone here since format() no longer does it
+    prefix, suffix = PROMPT_TEMPLATE_BATCH.split("{sections_block}")
+    return tuple(p.replace("{{", "{").replace("}}", "}") for p in (prefix, suffix))
+
+
+def build_messages(batch_inputs):
+    # Build the numbered SECTIONS block
+    sections_block = build_sections_block(batch_inputs)
+
+    prefix, suffix = _prompt_parts()
+    prompt = f"{prefix}{sections_block}{suffix}"
+
+    return [_SYS_MSG, {"role": "user", "content": prompt}]
+
 
 def call_llm_batch(batch_inputs):
     """
@@ -15,68 +62,48 @@ def call_llm_batch(batch_inputs):
     if not batch_inputs:
         return {}
 
-    # Build the numbered SECTIONS block
-    blocks = []
-    for entry in batch_inputs:
-        idx = entry["section_index"]
-        sent_list = entry["sentences"]
-        numbered = "\n".join(f"{i+1}. {s}" for i, s in enumerate(sent_list))
-        block = f"SECTION {idx}:\n{numbered}"
-        blocks.append(block)
-
-    sections_block = "\n\n".join(blocks)
-
-    prompt = PROMPT_TEMPLATE_BATCH.format(sections_block=sections_block)
-
     try:
         # Groq Chat Completion request
         response = client.chat.completions.create(
             model=MODEL,
-            messages=[
-                {"role": "system",
-                 "content": "You are a structured legal information extractor. Respond ONLY using strict JSON."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=build_messages(batch_inputs),
             temperature=0,
             response_format={"type": "json_object"},  # forces JSON object response
         )
 
         # Extract model output
-        text = response.choices[0].message.content
-
-        # Fail-safe: empty or None output → skip
-        if not text or not isinstance(text, str):
-            return {}
-
-        # Parse JSON safely
-        try:
-            parsed = json.loads(text)
-        except Exception as e:
-            print("LLM JSON parse error:", type(e).__name__, e)
-            return {}
-
-        # expected: list of objects, each with section_index + semantic data
-        if not isinstance(parsed, list):
-            parsed = [parsed]
-
-        out = {}
-        for item in parsed:
-            if not isinstance(item, dict):
-                continue
-            idx = item.get("section_index")
-            if idx is None:
-                continue
-
-            out[idx] = {
-                "roles": item.get("roles") or [],
-                "obligations": item.get("obligations") or [],
-                "powers": item.get("powers") or [],
-                "penalties": item.get("penalties") or [],
-                "rights": item.get("rights") or [],
-            }
-
-        return out
+        return parse_llm_output(response.choices[0].message.content)
+
+    except Exception as e:
+        print("LLM batch error:", type(e).__name__, e)
+        return {}
+
+
+async def acall_llm_batch(batch_inputs, sem):
+    """Async call_llm_batch on AsyncGroq; `sem` caps calls in flight."""
+    if not batch_inputs:
+        return {}
+
+    try:
+        async with sem:
+            response = await aclient.chat.completions.create(
+                model=MODEL,
+                messages=build_messages(batch_inputs),
+                temperature=0,
+                response_format={"type": "json_object"},
+            )
+        return parse_llm_output(response.choices[0].message.content)
 
     except Exception as e:
         print("LLM batch error:", type(e).__name__, e)
-        return {}
\ No newline at end of file
+        return {}
+
+
+async def call_llm_batches(entries, cache=None):
+    """
+    Pack entries into size-capped batches and run them concurrently (up to
+    MAX_CONCURRENCY). Returns merged section_index -> result; see
+    llm_batching.run_llm_batches for the `cache` handling.
+    """
+    salt = _cache_salt() if cache is not None else None
+    return await run_llm_batches(entries, acall_llm_batch, MAX_CONCURRENCY, cache, salt)
@@ -0,0 +1,45 @@
+# tests/test_enrich_rule_based.py
+# Regression checks for stage 03's rule-based extraction.
+
+import importlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+
+@pytest.fixture(scope="module")
+def enrich_rule_based(tmp_path_factory):
+    # importing config creates the data dirs relative to the cwd
+    cwd = Path.cwd()
+    sys.path.insert(0, str(SRC_DIR))
+    try:
+        os.chdir(tmp_path_factory.mktemp("data"))
+        yield importlib.import_module("03_enrich_rule_based")
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(str(SRC_DIR))
+
+
+def test_section_cite_inside_quoted_definition(enrich_rule_based):
+    sec = enrich_rule_based.enrich({"text": '"officer under section 5" means a person'})
+    assert sec["citations"] == [{"kind": "section", "raw": "section 5", "normalized": {}}]
+    assert [d["term"] for d in sec["defined_terms"]] == ["officer under section 5"]
+
+
+def test_notwithstanding_inside_quoted_definition(enrich_rule_based):
+    text = '"notwithstanding anything contained in this Act" includes rules'
+    sec = enrich_rule_based.enrich({"text": text})
+    assert sec["precedence_clauses"] == [
+        {"kind": "notwithstanding", "raw": "notwithstanding anything contained in"}
+    ]
+    assert len(sec["defined_terms"]) == 1
+
+
+def test_section_cite_running_into_amendment(enrich_rule_based):
+    sec = enrich_rule_based.enrich({"text": "section 5is hereby repealed"})
+    assert [c["raw"] for c in sec["citations"]] == ["section 5is"]
+    assert [a["type"] for a in sec["amendments"]] == ["repealed"]